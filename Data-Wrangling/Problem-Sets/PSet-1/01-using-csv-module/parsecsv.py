@@ -12,13 +12,24 @@ The data should be returned as a list of lists (not dictionaries).
 You can use the csv modules "reader" method to get data in such format.
 Another useful method is next() - to get the next line from the iterator.
 You should only change the parse_file function.
+
+parse_columns() reads the same file into typed NumPy columns instead: a
+datetime64 'datetime' column built from the date and time fields, and
+float32 columns for the irradiance and wind fields (or the columns asked
+for), so years of hourly data can be aggregated without converting each
+value with float().
 """
+from operator import itemgetter
 import csv
 import os
+import numpy as np
 
 DATADIR = ""
 DATAFILE = "745090.csv"
 
+# Irradiance and wind fields read by parse_columns() by default
+COLUMNS = ["ETR", "ETRN", "GHI", "DNI", "DHI", "Wdir", "Wspd"]
+
 def DR(csv):
     with open(csv, 'rb') as f:
         reader = csv.DictReader(f)
@@ -38,6 +49,66 @@ def parse_file(datafile):
     return (name, data)
 
 
+def short_name(header):
+    """Returns 'GHI' for 'GHI (W/m^2)', and 'GHI source' as it is."""
+    return header.split(' (')[0]
+
+
+def digits(strings, width):
+    """Returns the digits of fixed width strings as an int64 array."""
+    chars = strings.astype('S{0}'.format(width)).view(np.uint8)
+    return chars.reshape(-1, width).astype(np.int64) - ord('0')
+
+
+def to_datetime(dates, times):
+    """
+    Converts arrays of 'MM/DD/YYYY' and 'HH:MM' strings to datetime64[m],
+    all at once, from the digits of each field. The last hour of a day is
+    '24:00', which becomes 00:00 of the next day.
+    """
+    d = digits(dates, 10)
+    years = d[:, 6] * 1000 + d[:, 7] * 100 + d[:, 8] * 10 + d[:, 9]
+    months = (years - 1970) * 12 + d[:, 0] * 10 + d[:, 1] - 1
+    days = (months.astype('datetime64[M]').astype('datetime64[D]') +
+            (d[:, 3] * 10 + d[:, 4] - 1).astype('timedelta64[D]'))
+    c = digits(times, 5)
+    minutes = (c[:, 0] * 10 + c[:, 1]) * 60 + c[:, 3] * 10 + c[:, 4]
+    return days.astype('datetime64[m]') + minutes.astype('timedelta64[m]')
+
+
+def parse_columns(datafile, columns=COLUMNS):
+    """
+    Returns the station name and a dictionary of NumPy arrays: 'datetime'
+    plus a float32 array for each of columns, given by full header
+    ('GHI (W/m^2)') or short name ('GHI'). Only those columns are parsed.
+    Missing values are NaN.
+    """
+    with open(datafile, 'rb') as f:
+        reader = csv.reader(f)
+        name = reader.next()[1]
+        header = reader.next()
+        index = {}
+        for i, h in enumerate(header):
+            index[h] = index[short_name(h)] = i
+        # itemgetter() keeps only the wanted fields of each row, in C
+        pick = itemgetter(0, 1, *[index[column] for column in columns])
+        rows = map(pick, reader)
+    fields = zip(*rows) or [()] * (len(columns) + 2)
+    try:
+        values = np.array(fields[2:], dtype=np.float64)
+    except ValueError:
+        # Empty fields cannot be converted, make them 'nan' first
+        values = np.array(fields[2:], dtype='S32')
+        values[values == ''] = 'nan'
+        values = values.astype(np.float64)
+    values = values.astype(np.float32).reshape(len(columns), len(rows))
+    data = {'datetime': to_datetime(np.array(fields[0], dtype='S10'),
+                                    np.array(fields[1], dtype='S5'))}
+    for i, column in enumerate(columns):
+        data[column] = values[i]
+    return (name, data)
+
+
 def test():
     datafile = os.path.join(DATADIR, DATAFILE)
     name, data = parse_file(datafile)
@@ -51,5 +122,46 @@ def test():
     print data[2]
 
 
+def columns_test():
+    datafile = os.path.join(DATADIR, DATAFILE)
+    name, rows = parse_file(datafile)
+    name_c, data = parse_columns(datafile)
+    assert name_c == name
+    assert data['datetime'][0] == np.datetime64('2005-01-01T01:00')
+    # '24:00' is midnight at the start of the next day
+    assert data['datetime'][23] == np.datetime64('2005-01-02T00:00')
+    assert data['GHI'].dtype == np.float32
+    assert np.allclose(data['Wspd'], [float(row[46]) for row in rows])
+    __, data = parse_columns(datafile, ['Dry-bulb (C)'])
+    assert sorted(data) == ['Dry-bulb (C)', 'datetime']
+    print data['Dry-bulb (C)'].mean()
+
+
+def parse_times(datafile, columns=COLUMNS, repeat=10):
+    """
+    Returns the best seconds of parse_file() plus float() on each value of
+    columns, and of parse_columns(), on datafile.
+    """
+    import timeit
+    with open(datafile, 'rb') as f:
+        header = list(csv.reader(f))[1]
+    wanted = [i for i, h in enumerate(header)
+              if h in columns or short_name(h) in columns]
+
+    def baseline():
+        name, rows = parse_file(datafile)
+        return [[float(row[i]) for i in wanted] for row in rows]
+
+    return (min(timeit.repeat(baseline, number=1, repeat=repeat)),
+            min(timeit.repeat(lambda: parse_columns(datafile, columns),
+                              number=1, repeat=repeat)))
+
+
 if __name__ == "__main__":
-    test()
+    import sys
+    if len(sys.argv) == 2:
+        print 'parse_file + float(): {0:.4f}s, parse_columns(): {1:.4f}s'.format(
+            *parse_times(sys.argv[1]))
+    else:
+        test()
+        columns_test()
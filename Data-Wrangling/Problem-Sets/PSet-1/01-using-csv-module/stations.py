@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Reads a directory of NREL station files (one file like 745090.csv per
+station) in a process pool with parsecsv.parse_columns(), and saves them
+together as one NPZ file:
+
+- 'station_ids', 'names': one entry per station
+- 'offsets': the rows of station i are offsets[i]:offsets[i + 1]
+- 'datetime' and one float32 array per column: the rows of all stations
+
+Every parsed station is also kept in the cache directory as
+'<file name>.npz', together with the size and modification time of its
+file. A later run only parses the files that changed since, or that are new,
+and builds the combined file from the cache.
+
+    dataset = ingest('stations/', 'stations.npz', workers=8)
+    ghi = station(dataset, '745090')['GHI']
+"""
+import multiprocessing
+import csv
+import os
+import parsecsv
+
+CACHE_DIR = ".stationcache"
+
+
+def list_stations(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.csv')]
+
+
+def station_id(datafile):
+    with open(datafile, 'rb') as f:
+        return csv.reader([f.readline()]).next()[0]
+
+
+def cache_file(cache_dir, datafile):
+    return os.path.join(cache_dir, os.path.basename(datafile) + '.npz')
+
+
+def is_cached(cache_dir, datafile, columns):
+    """Returns True if the cached arrays of datafile are up to date."""
+    import numpy as np
+    filename = cache_file(cache_dir, datafile)
+    if not os.path.exists(filename):
+        return False
+    info = os.stat(datafile)
+    with np.load(filename) as cached:
+        return (int(cached['size']) == info.st_size and
+                float(cached['mtime']) == info.st_mtime and
+                list(cached['columns']) == list(columns))
+
+
+def parse_station(args):
+    """Parses one station file into the cache. Runs in a worker process."""
+    import numpy as np
+    datafile, cache_dir, columns = args
+    info = os.stat(datafile)
+    name, data = parsecsv.parse_columns(datafile, columns)
+    arrays = dict(('column_{0}'.format(i), data[column])
+                  for i, column in enumerate(columns))
+    np.savez(cache_file(cache_dir, datafile), station_id=station_id(datafile),
+             name=name, datetime=data['datetime'], size=info.st_size,
+             mtime=info.st_mtime, columns=np.array(columns), **arrays)
+    return datafile
+
+
+def ingest(directory, out, workers=None, cache_dir=CACHE_DIR,
+           columns=parsecsv.COLUMNS):
+    """
+    Parses the changed station files of directory in a pool of workers
+    processes, saves all stations to out (an NPZ file) and returns them as
+    a dictionary of arrays. dataset['parsed'] is the number of files that
+    had to be parsed.
+    """
+    import numpy as np
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    files = list_stations(directory)
+    stale = [(datafile, cache_dir, columns) for datafile in files
+             if not is_cached(cache_dir, datafile, columns)]
+    if stale:
+        pool = multiprocessing.Pool(workers)
+        try:
+            pool.map(parse_station, stale)
+        finally:
+            pool.close()
+            pool.join()
+    ids, names, datetimes, offsets = [], [], [], [0]
+    values = [[] for column in columns]
+    for datafile in files:
+        with np.load(cache_file(cache_dir, datafile)) as cached:
+            ids.append(str(cached['station_id']))
+            names.append(str(cached['name']))
+            datetimes.append(cached['datetime'])
+            for i in range(len(columns)):
+                values[i].append(cached['column_{0}'.format(i)])
+        offsets.append(offsets[-1] + len(datetimes[-1]))
+    dataset = {'station_ids': np.array(ids),
+               'names': np.array(names),
+               'offsets': np.array(offsets, dtype=np.int64),
+               'datetime': np.concatenate(datetimes) if datetimes
+                           else np.zeros(0, dtype='datetime64[m]')}
+    for column, parts in zip(columns, values):
+        dataset[column] = (np.concatenate(parts) if parts
+                           else np.zeros(0, dtype=np.float32))
+    np.savez(out, **dataset)
+    dataset['parsed'] = len(stale)
+    return dataset
+
+
+def station(dataset, station_id):
+    """Returns the arrays of one station of an ingested dataset."""
+    import numpy as np
+    i = int(np.flatnonzero(dataset['station_ids'] == station_id)[0])
+    start, end = dataset['offsets'][i], dataset['offsets'][i + 1]
+    return dict((key, values[start:end]) for key, values in dataset.items()
+                if key not in ('station_ids', 'names', 'offsets', 'parsed'))
+
+
+def test():
+    import numpy as np
+    import tempfile
+    import shutil
+    tmp = tempfile.mkdtemp()
+    try:
+        directory = os.path.join(tmp, 'stations')
+        os.makedirs(directory)
+        with open(parsecsv.DATAFILE, 'rb') as f:
+            lines = f.readlines()
+        for i in range(3):
+            with open(os.path.join(directory, '74509{0}.csv'.format(i)), 'wb') as f:
+                f.write(lines[0].replace('745090', '74509{0}'.format(i)))
+                f.writelines(lines[1:])
+        out = os.path.join(tmp, 'stations.npz')
+        cache_dir = os.path.join(tmp, 'cache')
+        dataset = ingest(directory, out, workers=2, cache_dir=cache_dir)
+        assert dataset['parsed'] == 3
+        assert list(dataset['station_ids']) == ['745090', '745091', '745092']
+        name, data = parsecsv.parse_columns(parsecsv.DATAFILE)
+        for column in parsecsv.COLUMNS:
+            assert np.array_equal(station(dataset, '745091')[column], data[column])
+        # Only the changed file is parsed again
+        os.utime(os.path.join(directory, '745092.csv'), (0, 0))
+        assert ingest(directory, out, workers=2, cache_dir=cache_dir)['parsed'] == 1
+        saved = np.load(out)
+        assert list(saved['offsets']) == [0, 98, 196, 294]
+        assert saved['datetime'].dtype == np.dtype('datetime64[m]')
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test()
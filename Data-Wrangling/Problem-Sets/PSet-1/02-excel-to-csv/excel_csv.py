@@ -16,39 +16,131 @@ SOUTH_C|2013|01|01|10|12345.6
 WEST|2013|01|01|10|12345.6
 '''
 
+# The workbook is loaded once into a 2-D NumPy array of hourly loads (one
+# column per region), so region_stats() finds the max, argmax, min, mean and
+# percentiles of every region in one vectorized pass, and the Excel dates of
+# all hours are converted to datetime64 at once instead of one cell at a time.
+# The arrays are cached next to the workbook as '<datafile>.npz', together
+# with its size and modification time, so later runs load them in
+# milliseconds instead of parsing the XLS file again.
+
 import xlrd
 import os
 import csv
+import numpy as np
 from zipfile import ZipFile
 datafile = "2013_ERCOT_Hourly_Load_Data.xls"
 outfile = "2013_Max_Loads.csv"
 
+PERCENTILES = [5, 25, 50, 75, 95]
+
 
 def open_zip(datafile):
-    with ZipFile('{0}.zip'.format(datafile), 'r') as myzip:
+    zipname = '{0}.zip'.format(datafile)
+    if os.path.exists(datafile):
+        if not os.path.exists(zipname):
+            return
+        with ZipFile(zipname, 'r') as myzip:
+            # Already extracted
+            if myzip.getinfo(os.path.basename(datafile)).file_size == os.path.getsize(datafile):
+                return
+    with ZipFile(zipname, 'r') as myzip:
         myzip.extractall()
 
 
-def parse_file(datafile):
+def cache_name(datafile):
+    return '{0}.npz'.format(datafile)
+
+
+def load_cached(datafile):
+    """Returns the cached load_sheet() arrays of datafile, or None if stale."""
+    filename = cache_name(datafile)
+    if not os.path.exists(filename):
+        return None
+    info = os.stat(datafile)
+    with np.load(filename) as cached:
+        if int(cached['size']) != info.st_size or float(cached['mtime']) != info.st_mtime:
+            return None
+        return list(cached['labels']), cached['times'], cached['loads']
+
+
+def save_cached(datafile, labels, times, loads):
+    info = os.stat(datafile)
+    tmp = '{0}.tmp'.format(cache_name(datafile))
+    with open(tmp, 'wb') as f:
+        np.savez(f, labels=np.array(labels), times=times, loads=loads,
+                 size=info.st_size, mtime=info.st_mtime)
+    os.rename(tmp, cache_name(datafile))
+
+
+def load_sheet(datafile, cache=True):
+    """
+    Returns the region labels, the hours as datetime64[s] and the loads as
+    a 2-D array with a column per region (the last, total column left out),
+    from the cache if the workbook has not changed since it was saved.
+    """
+    if cache:
+        cached = load_cached(datafile)
+        if cached is not None:
+            return cached
+    labels, times, loads = read_sheet(datafile)
+    if cache:
+        save_cached(datafile, labels, times, loads)
+    return labels, times, loads
+
+
+def read_sheet(datafile):
+    """Parses the workbook for load_sheet()."""
     workbook = xlrd.open_workbook(datafile)
     sheet = workbook.sheet_by_index(0)
+    labels = [sheet.cell_value(0, col) for col in range(1, sheet.ncols - 1)]
+    loads = np.array([sheet.col_values(col, start_rowx=1, end_rowx=sheet.nrows)
+                      for col in range(1, sheet.ncols - 1)], dtype=np.float64).T
+    dates = np.array(sheet.col_values(0, start_rowx=1, end_rowx=sheet.nrows),
+                     dtype=np.float64)
+    return [str(label) for label in labels], to_datetime(dates, workbook.datemode), loads
+
+
+def to_datetime(dates, datemode=0):
+    """Converts Excel date numbers to datetime64[s], rounded to the second."""
+    epoch = np.datetime64('1904-01-01' if datemode else '1899-12-30', 's')
+    return epoch + np.round(dates * 86400).astype(np.int64).astype('timedelta64[s]')
+
+
+def region_stats(labels, times, loads, percentiles=PERCENTILES):
+    """
+    Returns {label: {'max', 'max_time', 'min', 'min_time', 'mean',
+    'percentiles'}} for every region, computed for all columns at once.
+    """
+    argmax = loads.argmax(axis=0)
+    argmin = loads.argmin(axis=0)
+    columns = np.arange(loads.shape[1])
+    maxima = loads[argmax, columns]
+    minima = loads[argmin, columns]
+    means = loads.mean(axis=0)
+    quantiles = np.percentile(loads, percentiles, axis=0)
+    stats = {}
+    for i, label in enumerate(labels):
+        stats[label] = {'max': float(maxima[i]),
+                        'max_time': times[argmax[i]],
+                        'min': float(minima[i]),
+                        'min_time': times[argmin[i]],
+                        'mean': float(means[i]),
+                        'percentiles': dict(zip(percentiles, quantiles[:, i].tolist()))}
+    return stats
+
+
+def parse_file(datafile):
+    labels, times, loads = load_sheet(datafile)
+    stats = region_stats(labels, times, loads)
     data = []
-    
-    maxvalues = {} # structure: {label: [maxload(0), time(1)]}
-    for col in range(1, sheet.ncols - 1):
-        label = sheet.cell_value(0, col)
-        column = sheet.col_values(col, start_rowx=1, end_rowx=sheet.nrows)
-        maxvalues[label] = [max(column)]
-        maxrownum = column.index(max(column)) + 1
-        maxvalues[label].append(sheet.cell_value(maxrownum, 0))
-    
+
     stations = ['COAST', 'EAST', 'FAR_WEST', 'NORTH', 'NORTH_C', 'SOUTHERN', 'SOUTH_C', 'WEST']
     for station in stations:
         row = [station]
-        time = xlrd.xldate_as_tuple(maxvalues[station][1], 0)
-        for index in range(len(time[:4])):
-            row.append(time[index])
-        row.append(maxvalues[station][0])
+        time = stats[station]['max_time'].astype(object)
+        row.extend([time.year, time.month, time.day, time.hour])
+        row.append(stats[station]['max'])
         data.append(row)
 
     print data
@@ -78,5 +170,56 @@ def test():
                 for field in fields:
                     assert ans[s][field] == line[field]
 
-        
-test()
+
+def stats_test(datafile=datafile):
+    labels, times, loads = load_sheet(datafile)
+    stats = region_stats(labels, times, loads)
+    far_west = stats['FAR_WEST']
+    assert repr(far_west['max']) == "2281.2722140000024"
+    assert str(far_west['max_time']) == "2013-06-26T17:00:00"
+    assert far_west['min'] <= far_west['percentiles'][50] <= far_west['max']
+    # Same as xlrd.xldate_as_tuple() on rows 1, 100 and the last one
+    assert [str(times[i]) for i in (0, 99, -1)] == [
+        "2013-01-01T01:00:00", "2013-01-05T04:00:00", "2013-11-01T00:00:00"]
+
+
+def cache_test():
+    """
+    Runs stats_test() and checks the NPZ cache on a temporary copy of the
+    workbook, counting how often xlrd opens it.
+    """
+    import tempfile
+    import shutil
+    opened = []
+    open_workbook = xlrd.open_workbook
+
+    def counting_open(filename, *args, **kwargs):
+        opened.append(filename)
+        return open_workbook(filename, *args, **kwargs)
+
+    open_zip(datafile)
+    tmp = tempfile.mkdtemp()
+    xlrd.open_workbook = counting_open
+    try:
+        copy = os.path.join(tmp, os.path.basename(datafile))
+        shutil.copy2(datafile, copy)
+        labels, times, loads = load_sheet(copy)
+        stats_test(copy)
+        cached = load_sheet(copy)
+        assert len(opened) == 1
+        assert cached[0] == labels
+        assert np.array_equal(cached[1], times) and np.array_equal(cached[2], loads)
+        # A changed workbook is parsed again
+        info = os.stat(copy)
+        os.utime(copy, (info.st_atime, info.st_mtime + 1))
+        assert load_cached(copy) is None
+        load_sheet(copy)
+        assert len(opened) == 2
+    finally:
+        xlrd.open_workbook = open_workbook
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test()
+    cache_test()
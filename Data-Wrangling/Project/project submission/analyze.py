@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# analyze.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Runs the audits from mapparser.py, tags.py, users.py and audit.py in a single
+pass over the map file. Each audit is an "analyzer" object with two methods:
+
+- process(top) is called once for every complete top level element (and
+  last for the root element), which the analyzer walks for the
+  descendants it needs.
+- result() returns the same value as the original stand-alone function.
+
+analyze() parses the file once, feeds every top level element to every
+analyzer and returns a dictionary of results keyed by analyzer name. The file
+is streamed with osmstream.iter_elements(), so memory stays flat. Calling the
+analyzers per top level element rather than for every <nd> and <tag> keeps
+the Python calls from eating what the shared parse saves.
+"""
+from collections import defaultdict
+import pprint
+import audit #local *.py file
+import osmstream #local *.py file
+import tags #local *.py file
+import users #local *.py file
+
+
+class TagCounter(object):
+    """Counts each tag name, as mapparser.count_tags()."""
+    name = 'tags'
+
+    def __init__(self):
+        self.tags = defaultdict(int)
+
+    def process(self, top):
+        tags = self.tags
+        for elem in top.iter():
+            tags[elem.tag] += 1
+
+    def result(self):
+        return dict(self.tags)
+
+
+class KeyTypeCounter(object):
+    """Classifies the 'k' value of each <tag>, as tags.process_map()."""
+    name = 'keys'
+
+    def __init__(self):
+        self.keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+        # The few thousand distinct keys repeat, so each is matched once
+        self.kinds = {}
+
+    def kind(self, k):
+        """Returns the count tags.key_type() adds key k to."""
+        if tags.problemchars.search(k):
+            kind = 'problemchars'
+        elif tags.lower_colon.search(k):
+            kind = 'lower_colon'
+        elif tags.lower.search(k):
+            kind = 'lower'
+        else:
+            kind = 'other'
+        self.kinds[k] = kind
+        return kind
+
+    def process(self, top):
+        kinds = self.kinds
+        for tag in top.iter("tag"):
+            k = tag.attrib['k']
+            self.keys[kinds.get(k) or self.kind(k)] += 1
+
+    def result(self):
+        return self.keys
+
+
+class UserCollector(object):
+    """Collects the unique user IDs, as users.process_map()."""
+    name = 'users'
+
+    def __init__(self):
+        self.users = set()
+
+    def process(self, top):
+        # Only top level elements carry a "uid" attribute
+        uid = users.get_user(top)
+        if uid != None:
+            self.users.add(uid)
+
+    def result(self):
+        return self.users
+
+
+class StreetTypeAuditor(object):
+    """Collects unexpected street types, as audit.audit()."""
+    name = 'street_types'
+
+    def __init__(self):
+        self.street_types = defaultdict(set)
+
+    def process(self, top):
+        if top.tag == "node" or top.tag == "way":
+            for tag in top.iter("tag"):
+                if audit.is_street_name(tag):
+                    audit.audit_street_type(self.street_types, tag.attrib['v'])
+
+    def result(self):
+        return self.street_types
+
+
+ANALYZERS = [TagCounter, KeyTypeCounter, UserCollector, StreetTypeAuditor]
+
+
+def analyze(filename, analyzers=None):
+    """
+    Parses filename once and returns {analyzer.name: analyzer.result()}
+    for each analyzer. Defaults to one instance of every class in ANALYZERS.
+    """
+    if analyzers is None:
+        analyzers = [cls() for cls in ANALYZERS]
+    for top in osmstream.iter_elements(filename, tags=None, root=True):
+        for analyzer in analyzers:
+            analyzer.process(top)
+    return dict((analyzer.name, analyzer.result()) for analyzer in analyzers)
+
+
+def main_test():
+    results = analyze('charlotte.osm')
+    pprint.pprint(results['tags'])
+    assert results['tags'] == {'bounds': 1,
+                               'member': 12112,
+                               'nd': 1623443,
+                               'node': 1471350,
+                               'osm': 1,
+                               'relation': 321,
+                               'tag': 667155,
+                               'way': 84502}
+    assert results['keys'] == {'lower': 227362,
+                               'lower_colon': 290941,
+                               'other': 148852,
+                               'problemchars': 0}
+    assert len(results['users']) == 351
+    assert len(results['street_types']) == 19
+
+
+def example_test():
+    results = analyze('example.osm')
+    pprint.pprint(results['tags'])
+    assert results['tags'] == {'member': 7125,
+                               'meta': 1,
+                               'nd': 52969,
+                               'node': 46721,
+                               'note': 1,
+                               'osm': 1,
+                               'relation': 44,
+                               'tag': 27012,
+                               'way': 3781}
+    assert results['keys'] == {'lower': 11692,
+                               'lower_colon': 14261,
+                               'other': 1059,
+                               'problemchars': 0}
+    assert len(results['users']) == 115
+    assert len(results['street_types']) == 6
+
+
+if __name__ == "__main__":
+    example_test()
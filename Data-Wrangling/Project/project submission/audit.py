@@ -9,18 +9,24 @@
 # matthewbanbury@gmail.com
 
 """
-- Audits the OSMFILE and changes the variable 'mapping' to reflect the changes
-    needed to fix the unexpected street types to the appropriate ones in the
-    expected list. Mappings have been added only for the actual problems found
-    in this OSMFILE, not for a generalized solution, since that may and will
-    depend on the particular area being audited.
+- Audits the OSMFILE for street types that are not in the expected list.
+    The 'mapping' that fixes them to the appropriate ones is read from the
+    "street_abbreviations" of rules.json, so it is changed there. Mappings
+    have been added only for the actual problems found in this OSMFILE, not
+    for a generalized solution, since that may and will depend on the
+    particular area being audited.
 - The update function fixes the street name. It takes a string with a street
     name as an argument and returns the fixed name.
+- StreetNormalizer does the same as update() for data.py, but remembers the
+    most recently fixed names, since the same few thousand street names
+    repeat throughout the file. The one data.py cleans with is built from
+    rules.json, and its cache counts are data.cleaning_rules.normalizer.stats().
 """
-from collections import defaultdict
-import xml.etree.cElementTree as ET
+from collections import defaultdict, OrderedDict
 import pprint
 import re
+import osmstream #local *.py file
+import rules #local *.py file
 
 
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
@@ -29,35 +35,13 @@ expected = ["Street", "Avenue", "Boulevard", "Drive",
             "Trail", "Parkway", "Commons", "Cirle",
             "Cove", "Highway", "Park", "Way", "South"]
 
-# Updated mapping reflects changes needed in charlotte.osm file
-mapping = { "E": "East",
-            "W": "West",
-            "N": "North",
-            "S": "South",
-            "Rd": "Road",
-            "Rd.": "Road",
-            "ln": "Lane",
-            "ln.": "Lane",
-            "Ln": "Lane",
-            "Ln.": "Lane",
-            "Dr": "Drive",
-            "Dr.": "Drive",
-            "St": "Street",
-            "St.": "Street",
-            "Ste": "Suite",
-            "Ste.": "Suite",
-            "Cir": "Circle",
-            "Ave": "Avenue",
-            "Ave.": "Avenue",
-            "Hwy": "Highway",
-            "Hwy.": "Highway",
-            "Pky": "Parkway",
-            "Pky.": "Parkway",
-            "Fwy": "Freeway",
-            "Fwy.": "Freeway",
-            "Blvd": "Boulevard",
-            "Blvd.": "Boulevard"
-            }
+# The mapping reflects the changes needed in the charlotte.osm file. It is
+# kept in rules.json, with the words after which nothing is replaced, so the
+# audit and the cleaning in data.py use the same fixes
+street_rules = rules.load()
+mapping = street_rules['street_abbreviations']
+# For example, don't update 'Suite E' to 'Suite East'
+keep_after = frozenset(street_rules['street_keep_after'])
 
 
 def audit_street_type(street_types, street_name):
@@ -76,22 +60,18 @@ def is_street_name(elem):
     return (elem.attrib['k'] == "addr:street")
 
 
-def audit(osmfile):
+def audit(osmfile, workers=None):
     """
     Returns a list of problematic street type values
     for use with the update() name mapping.
+    workers is the size of the pool decoding a PBF file (0 for none).
     """
-    osm_file = open(osmfile, "r")
     street_types = defaultdict(set)
-    parser = ET.iterparse(osm_file, events=("start",))
-    for event, elem in parser:
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
-        # Safe to clear() now that descendants have been accessed
-        elem.clear()
-    del parser
+    # Elements arrive complete, after their end tag
+    for elem in osmstream.iter_elements(osmfile, tags=("node", "way"), workers=workers):
+        for tag in elem.iter("tag"):
+            if is_street_name(tag):
+                audit_street_type(street_types, tag.attrib['v'])
     return street_types
 
 
@@ -104,11 +84,53 @@ def update(name, mapping):
     words = name.split()
     for w in range(len(words)):
         if words[w] in mapping:
-            if words[w-1].lower() not in ['suite', 'ste.', 'ste']: # For example, don't update 'Suite E' to 'Suite East'
+            if words[w-1].lower() not in keep_after:
                 words[w] = mapping[words[w]]
     name = " ".join(words)
     return name
 
+
+class StreetNormalizer(object):
+    """
+    Callable that returns update(name, mapping), keeping up to 'size'
+    recently used names in an LRU cache so repeated names are only
+    split and looked up once. hits and misses count cache lookups.
+    """
+    keep_after = keep_after
+
+    def __init__(self, mapping, size=10000):
+        self.mapping = dict(mapping)
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, name):
+        try:
+            better_name = self.cache.pop(name)
+            self.hits += 1
+        except KeyError:
+            better_name = self.update(name)
+            self.misses += 1
+            if len(self.cache) >= self.size:
+                self.cache.popitem(last=False)
+        self.cache[name] = better_name
+        return better_name
+
+    def update(self, name):
+        """Same rules as update(), using the precompiled tables."""
+        mapping = self.mapping
+        words = name.split()
+        for w, word in enumerate(words):
+            if word in mapping and words[w-1].lower() not in self.keep_after:
+                words[w] = mapping[word]
+        return " ".join(words)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache)}
+
+
 # EXPERIMENTAL UNUSED METHOD
 # Opted not to use in data.py over the more generalized
 # and more optimal 'update()' method above
@@ -168,5 +190,16 @@ def example_test():
                 assert better_name == "West 9th Street"
 
 
+def normalizer_test():
+    normalize = StreetNormalizer(mapping, size=2)
+    names = ["West Stanly St.", "S Tryon St Ste 105", "Suite E Blvd", "E Suite"]
+    for name in names + names:
+        assert normalize(name) == update(name, mapping)
+    assert normalize.stats() == {'hits': 0, 'misses': 8, 'size': 2}
+    for i in range(10):
+        normalize("W 9th St")
+    assert normalize.stats() == {'hits': 9, 'misses': 9, 'size': 2}
+
+
 if __name__ == '__main__':
     example_test()
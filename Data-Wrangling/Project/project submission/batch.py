@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# batch.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Runs data.process_map, audit.audit and users.process_map over many map
+files at once, one file per process of a pool.
+
+    python batch.py extracts/ --out results --workers 8
+    python batch.py extracts.txt --tasks users audit
+
+The input is a directory (every *.osm and *.osm.pbf file in it) or a
+manifest listing one file per line, relative to the manifest, with '#'
+starting a comment. The largest files are handed out first, so a big extract
+is not left to run alone at the end while the other workers sit idle. PBF
+files are decoded inside their worker (pool workers cannot start pools of
+their own).
+
+Each file gets its own outputs in the output directory, named after the file
+without its extension (with '-1', '-2', ... added where two inputs share a
+name, see output_names()):
+
+- <name>.json          the shaped data from data.process_map
+- <name>.audit.json    {street type: [street names]} from audit.audit
+- <name>.users.json    the sorted user IDs from users.process_map
+
+summary.json lists, for each file, its size, the seconds each task took, its
+outputs and counts, and the error if a task failed or the file could not be
+read. One failed or missing file does not stop the others.
+"""
+from collections import OrderedDict
+import multiprocessing
+import traceback
+import argparse
+import json
+import time
+import os
+import audit #local *.py file
+import data #local *.py file
+import users #local *.py file
+import writers #local *.py file
+
+TASKS = ['data', 'audit', 'users']
+SUMMARY = 'summary.json'
+EXTENSIONS = ('.osm', '.osm.pbf')
+
+
+def list_inputs(source):
+    """Returns the map files of a directory or a manifest file."""
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source))
+                if name.endswith(EXTENSIONS)]
+    base = os.path.dirname(source)
+    files = []
+    with open(source) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                files.append(os.path.join(base, line))
+    return files
+
+
+def file_size(filename):
+    """Returns the size of filename, or -1 if it cannot be read."""
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return -1
+
+
+def schedule(files):
+    """Returns files largest first, those that cannot be read last."""
+    return sorted(files, key=file_size, reverse=True)
+
+
+def output_names(files):
+    """
+    Returns the output name of each of files: the file name without its
+    .osm or .osm.pbf extension, and '-1', '-2', ... added in input order
+    where two files would get the same name (x.osm and x.osm.pbf, or the
+    same file name in two directories).
+    """
+    names = []
+    for filename in files:
+        name = os.path.basename(filename)
+        for extension in EXTENSIONS[::-1]:
+            if name.endswith(extension):
+                name = name[:-len(extension)]
+                break
+        names.append(name)
+    seen = {}
+    result = []
+    for name in names:
+        if names.count(name) > 1:
+            seen[name] = seen.get(name, 0) + 1
+            name = '{0}-{1}'.format(name, seen[name])
+        result.append(name)
+    return result
+
+
+def run_data(filename, prefix, options):
+    file_out = writers.output_name(prefix + '.json', options.get('compress'))
+    writer = writers.JSONWriter(file_out, options.get('pretty', False),
+                                options.get('fast', False))
+    data.process_map(filename, writer=writer, workers=0)
+    return file_out, writer.count
+
+
+def run_audit(filename, prefix, options):
+    file_out = prefix + '.audit.json'
+    street_types = audit.audit(filename, workers=0)
+    with open(file_out, 'w') as f:
+        json.dump(dict((k, sorted(v)) for k, v in street_types.items()), f,
+                  indent=2, sort_keys=True)
+    return file_out, len(street_types)
+
+
+def run_users(filename, prefix, options):
+    file_out = prefix + '.users.json'
+    found = users.process_map(filename, fast=options.get('fast', False), workers=0)
+    with open(file_out, 'w') as f:
+        json.dump(sorted(found), f)
+    return file_out, len(found)
+
+
+RUNNERS = {'data': run_data, 'audit': run_audit, 'users': run_users}
+
+
+def process_file(args):
+    """Runs tasks on one file and returns its summary. Runs in a worker process."""
+    filename, name, out_dir, tasks, options = args
+    prefix = os.path.join(out_dir, name)
+    summary = {'file': filename, 'size': None,
+               'seconds': {}, 'outputs': {}, 'counts': {}}
+    try:
+        summary['size'] = os.path.getsize(filename)
+    except OSError:
+        summary['errors'] = {'file': traceback.format_exc()}
+        return summary
+    for task in tasks:
+        start = time.time()
+        try:
+            file_out, count = RUNNERS[task](filename, prefix, options)
+        except Exception:
+            summary.setdefault('errors', {})[task] = traceback.format_exc()
+            continue
+        finally:
+            summary['seconds'][task] = time.time() - start
+        summary['outputs'][task] = file_out
+        summary['counts'][task] = count
+    return summary
+
+
+def run_batch(files, out_dir, workers=None, tasks=TASKS, **options):
+    """
+    Processes files in a pool of workers processes, largest first, and
+    writes the summary of every file to '<out_dir>/summary.json'.
+    Returns the summaries in the order the files finished.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # A file listed twice is processed once
+    files = list(OrderedDict((os.path.normpath(f), f) for f in files).values())
+    names = dict(zip(files, output_names(files)))
+    jobs = [(filename, names[filename], out_dir, tasks, options)
+            for filename in schedule(files)]
+    start = time.time()
+    pool = multiprocessing.Pool(workers)
+    summaries = []
+    try:
+        for summary in pool.imap_unordered(process_file, jobs):
+            summaries.append(summary)
+            print '{0:40} {1:8.1f} MB {2:8.2f}s{3}'.format(
+                os.path.basename(summary['file']), (summary['size'] or 0) / 1e6,
+                sum(summary['seconds'].values()),
+                '  FAILED' if 'errors' in summary else '')
+    finally:
+        pool.close()
+        pool.join()
+    report = {'seconds': time.time() - start,
+              'workers': workers or multiprocessing.cpu_count(),
+              'tasks': tasks,
+              'failed': sum(1 for s in summaries if 'errors' in s),
+              'files': summaries}
+    with open(os.path.join(out_dir, SUMMARY), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return summaries
+
+
+def test():
+    import tempfile
+    import shutil
+    import generate #local *.py file
+    import pbf #local *.py file
+    tmp = tempfile.mkdtemp()
+    try:
+        for i, size in enumerate([300000, 100000, 200000]):
+            generate.generate(os.path.join(tmp, 'city{0}.osm'.format(i)), size, seed=i)
+        with open(os.path.join(tmp, 'broken.osm'), 'w') as f:
+            f.write('<osm><node id="1"')
+        pbf.write_test_file(os.path.join(tmp, 'small.osm.pbf'))
+        files = list_inputs(tmp)
+        assert [os.path.basename(f) for f in schedule(files)] == [
+            'city0.osm', 'city2.osm', 'city1.osm', 'small.osm.pbf', 'broken.osm']
+        out_dir = os.path.join(tmp, 'out')
+        summaries = run_batch(files, out_dir, workers=2)
+        with open(os.path.join(out_dir, SUMMARY)) as f:
+            report = json.load(f)
+        assert len(report['files']) == 5 and report['failed'] == 1
+        small = [s for s in summaries if s['file'].endswith('.pbf')][0]
+        assert 'errors' not in small and small['counts']['data'] == 3
+        assert small['outputs']['data'] == os.path.join(out_dir, 'small.json')
+        # A missing file is reported, and x.osm, x.osm.pbf and other/x.osm
+        # get outputs of their own
+        os.makedirs(os.path.join(tmp, 'other'))
+        shutil.copy(os.path.join(tmp, 'city1.osm'), os.path.join(tmp, 'x.osm'))
+        shutil.copy(os.path.join(tmp, 'city2.osm'), os.path.join(tmp, 'other', 'x.osm'))
+        shutil.copy(os.path.join(tmp, 'small.osm.pbf'), os.path.join(tmp, 'x.osm.pbf'))
+        manifest = os.path.join(tmp, 'extracts.txt')
+        with open(manifest, 'w') as f:
+            f.write('x.osm\nmissing.osm  # gone\nx.osm.pbf\nother/x.osm\nx.osm\n')
+        files = list_inputs(manifest)
+        assert output_names(files) == ['x-1', 'missing', 'x-2', 'x-3', 'x-4']
+        listed = run_batch(files, os.path.join(tmp, 'listed'), workers=2,
+                           tasks=['users'])
+        assert len(listed) == 4
+        missing = [s for s in listed if s['file'].endswith('missing.osm')][0]
+        assert missing['errors'].keys() == ['file'] and missing['size'] is None
+        names = sorted(os.path.basename(s['outputs']['users'])
+                       for s in listed if 'errors' not in s)
+        assert names == ['x-1.users.json', 'x-2.users.json', 'x-3.users.json']
+        for summary in summaries:
+            if summary['file'].endswith('city1.osm'):
+                with open(summary['outputs']['users']) as f:
+                    assert set(json.load(f)) == users.process_map(summary['file'])
+                assert os.path.exists(os.path.join(out_dir, 'city1.json'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('source', help='directory of *.osm and *.osm.pbf files or a manifest')
+    parser.add_argument('--out', default='batch')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--tasks', nargs='+', default=TASKS,
+                        help=', '.join(TASKS))
+    parser.add_argument('--compress', choices=['gzip', 'zstd'])
+    parser.add_argument('--fast', action='store_true')
+    args = parser.parse_args()
+    for task in args.tasks:
+        if task not in RUNNERS:
+            parser.error('unknown task {0}'.format(task))
+    run_batch(list_inputs(args.source), args.out, args.workers, args.tasks,
+              compress=args.compress, fast=args.fast)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# benchmark.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Times the project scripts on synthetic map files from generate.py and records
+their throughput and peak memory, so that slowdowns are caught before they
+reach a real extract.
+
+    python benchmark.py                       # 10MB and 100MB files
+    python benchmark.py 1GB --out new.json --baseline old.json
+    python benchmark.py --shape charlotte.osm  # shape_element() vs ReferenceShaper
+
+Each benchmark runs in its own Python process, so the peak resident set size
+it reports belongs to that run alone. Generated files are kept in BENCH_DIR
+and reused. With --baseline, any benchmark that got more than --tolerance
+slower or bigger than in the baseline results is reported as a regression and
+the script exits with status 1.
+"""
+import argparse
+import subprocess
+import resource
+import json
+import time
+import sys
+import os
+import generate #local *.py file
+import rules #local *.py file
+
+BENCH_DIR = 'bench'
+SIZES = {'10MB': 10 << 20, '100MB': 100 << 20, '1GB': 1 << 30}
+
+# (name, module, function, keyword arguments)
+BENCHMARKS = [
+    ('count_tags', 'mapparser', 'count_tags', {}),
+    ('count_tags fast', 'mapparser', 'count_tags', {'fast': True}),
+    ('tags.process_map', 'tags', 'process_map', {}),
+    ('users.process_map', 'users', 'process_map', {}),
+    ('users.process_map fast', 'users', 'process_map', {'fast': True}),
+    ('audit.audit', 'audit', 'audit', {}),
+    ('analyze.analyze', 'analyze', 'analyze', {}),
+    ('data.process_map', 'data', 'process_map', {}),
+    ('sketches.approx_stats', 'sketches', 'approx_stats', {}),
+]
+
+
+def synthetic_file(label):
+    """Returns the path of the synthetic file for size label, making it if needed."""
+    if not os.path.isdir(BENCH_DIR):
+        os.makedirs(BENCH_DIR)
+    filename = os.path.join(BENCH_DIR, 'synthetic-{0}.osm'.format(label))
+    if not os.path.exists(filename):
+        generate.generate(filename, SIZES[label])
+    return filename
+
+
+def run_one(module, function, kwargs, filename):
+    """Runs one benchmark in this process and returns its measurements."""
+    func = getattr(__import__(module), function)
+    start = time.time()
+    func(filename, **kwargs)
+    seconds = time.time() - start
+    return {'seconds': seconds,
+            'mb_per_sec': os.path.getsize(filename) / 1e6 / seconds,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+
+def run(module, function, kwargs, filename):
+    """Runs one benchmark in a new Python process."""
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--run', module, function,
+         json.dumps(kwargs), filename])
+    result = json.loads(output.splitlines()[-1])
+    for suffix in ('.json', '.nodes.ids.npy', '.nodes.coords.npy'):
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
+    return result
+
+
+def run_all(labels):
+    results = {}
+    for label in labels:
+        filename = synthetic_file(label)
+        for name, module, function, kwargs in BENCHMARKS:
+            result = run(module, function, kwargs, filename)
+            results['{0} {1}'.format(name, label)] = result
+            print '{0:24} {1:>6} {2:8.2f}s {3:8.1f} MB/s {4:8.1f} MB peak'.format(
+                name, label, result['seconds'], result['mb_per_sec'],
+                result['peak_rss_mb'])
+    return results
+
+
+def regressions(results, baseline, tolerance=0.2):
+    """Returns a message for every result worse than baseline by tolerance."""
+    found = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        for metric in ('seconds', 'peak_rss_mb'):
+            old = baseline[key][metric]
+            if result[metric] > old * (1 + tolerance):
+                found.append('{0}: {1} {2:.2f} -> {3:.2f}'.format(
+                    key, metric, old, result[metric]))
+    return found
+
+
+class ReferenceShaper(object):
+    """
+    data.shape_element() as it was before the rules moved to rules.json:
+    the Charlotte keys are written into the code and every key is sorted
+    into a class by an if/elif chain. shape_times() times it as the
+    baseline for the rule-driven shape_element(), and test() checks that
+    both still shape a map file alike.
+    """
+    IGNORED_KEYS = frozenset(['ele', 'import_uuid', 'source', 'wikipedia'])
+    IGNORED_PREFIXES = frozenset(['gnis:', 'is_in', 'nhd-s'])
+    PROBLEM, IGNORED, ADDRESS, TIGER, REF, TYPE, PLAIN = range(7)
+
+    def __init__(self):
+        import audit #local *.py file
+        import data #local *.py file
+        self.data = data
+        self.normalizer = audit.StreetNormalizer(audit.mapping)
+        self.key_classes = {}
+        self.key_handlers = {self.ADDRESS: self.update_address,
+                             self.TIGER: data.process_tiger,
+                             self.REF: self.update_ref,
+                             self.TYPE: self.update_type,
+                             self.PLAIN: self.update_plain}
+
+    def classify_key(self, k):
+        try:
+            return self.key_classes[k]
+        except KeyError:
+            pass
+        if self.data.problemchars.search(k):
+            cls = self.PROBLEM
+        elif k in self.IGNORED_KEYS or k[:5] in self.IGNORED_PREFIXES:
+            cls = self.IGNORED
+        elif k.startswith('tiger:'):
+            cls = self.TIGER
+        elif k.startswith('addr:'):
+            cls = self.ADDRESS if k.count(':') == 1 else self.IGNORED
+        elif k == 'ref':
+            cls = self.REF
+        elif k == 'type':
+            cls = self.TYPE
+        else:
+            cls = self.PLAIN
+        self.key_classes[k] = cls
+        return cls
+
+    def update_address(self, node, k, tag):
+        v = tag.attrib['v']
+        if 'address' not in node:
+            node['address'] = {}
+        if k == 'addr:postcode' and len(v) > 5:
+            v = rules.fix_postcode(v)
+        elif k == 'addr:street':
+            v = self.normalizer(v)
+        node['address'][k[5:]] = v
+        return node
+
+    def update_ref(self, node, k, tag):
+        if node['type'] == 'node':
+            node['exit_number'] = tag.attrib['v']
+        else:
+            node[k] = tag.attrib['v']
+        return node
+
+    def update_type(self, node, k, tag):
+        node['service_type'] = tag.attrib['v']
+        return node
+
+    def update_plain(self, node, k, tag):
+        node[k] = tag.attrib['v']
+        return node
+
+    def __call__(self, element):
+        node = {}
+        if element.tag == "node" or element.tag == "way":
+            node['type'] = element.tag
+            node['created'] = {}
+            if 'lat' in element.attrib:
+                node['pos'] = self.data.get_pos(element)
+            for tag in element.iter():
+                for key, value in tag.items():
+                    if key in self.data.CREATED:
+                        node['created'][key] = value
+                    elif key == 'k':
+                        cls = self.classify_key(value)
+                        if cls in self.key_handlers:
+                            node = self.key_handlers[cls](node, value, tag)
+                        elif cls == self.PROBLEM:
+                            node[key] = value
+                    elif key == 'ref':
+                        if 'node_refs' not in node:
+                            node['node_refs'] = []
+                        node['node_refs'].append(value)
+                    elif key not in ('v', 'lat', 'lon'):
+                        node[key] = value
+            if 'address' in node and 'street' in node['address']:
+                if isinstance(node['address']['street'], dict):
+                    node['address']['street'] = self.data.join_segments(
+                        node['address']['street'])
+            element.clear()
+            return node
+        else:
+            return None
+
+
+def shape_times(filename, repeat=5):
+    """
+    Returns [(name, microseconds per element)] of ReferenceShaper and of
+    data.shape_element() with rules.json and with 5000 more rules, on
+    filename (see rules.shape_time()).
+    """
+    return [('hard-coded', rules.shape_time(filename, repeat=repeat,
+                                            shape=ReferenceShaper())),
+            ('rules', rules.shape_time(filename, repeat=repeat)),
+            ('5000 extra rules', rules.shape_time(filename, 5000, repeat))]
+
+
+def test():
+    import xml.etree.cElementTree as ET
+    import tempfile
+    import shutil
+    import data #local *.py file
+    results = {'data.process_map 10MB': {'seconds': 1.3, 'peak_rss_mb': 20.0}}
+    baseline = {'data.process_map 10MB': {'seconds': 1.0, 'peak_rss_mb': 19.0}}
+    assert regressions(results, baseline) == [
+        'data.process_map 10MB: seconds 1.00 -> 1.30']
+    assert regressions(baseline, results) == []
+    # rules.json cleans a map file the same as the hard-coded reference
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'map.osm')
+        generate.generate(filename, 1 << 20, seed=5)
+        reference = ReferenceShaper()
+        for elem in ET.parse(filename).getroot():
+            expected = reference(ET.fromstring(ET.tostring(elem)))
+            assert data.shape_element(elem) == expected
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('sizes', nargs='*', default=['10MB', '100MB'],
+                        help=', '.join(sorted(SIZES)))
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--shape', metavar='FILE',
+                        help='time the hard-coded and rule-driven shaping of FILE')
+    parser.add_argument('--run', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.shape:
+        for name, micros in shape_times(args.shape):
+            print '{0:18} {1:8.2f} us per element'.format(name, micros)
+        return
+    if args.run:
+        module, function, kwargs, filename = args.run
+        print json.dumps(run_one(module, function, json.loads(kwargs), filename))
+        return
+    for label in args.sizes:
+        if label not in SIZES:
+            parser.error('unknown size {0}'.format(label))
+    results = run_all(args.sizes)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for message in found:
+            print 'REGRESSION', message
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
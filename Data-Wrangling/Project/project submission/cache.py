@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# cache.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Keeps the results of audit.audit, tags.process_map, mapparser.count_tags and
+the like on disk, so running them again on an unchanged map file returns at
+once instead of parsing the whole file.
+
+    import audit, cache
+    street_types = cache.cached(audit.audit, 'charlotte.osm')
+
+A result is stored under a key made from:
+
+- the absolute path, size and modification time of the map file, or a
+  SHA-1 of its contents with use_hash=True (for copies of the same file)
+- the module and name of the function, its keyword arguments, and a hash
+  of the module's source file, so a changed function is not answered from
+  old results
+- the version of the cleaning rules data.py is using, a hash of the rules
+  (rules.CompiledRules.version), so rules switched on with data.use_rules()
+  get results of their own
+
+Results are pickled into CACHE_DIR, one file per key, written to a
+temporary file first so a reader never sees half a result. Each hit
+touches its file, and after every store the least recently used files are
+removed until the cache is under max_size bytes.
+"""
+import cPickle as pickle
+import tempfile
+import hashlib
+import json
+import sys
+import os
+import data #local *.py file
+
+CACHE_DIR = os.environ.get('OSM_CACHE_DIR', '.osmcache')
+MAX_SIZE = 256 << 20
+BLOCK_SIZE = 1 << 20
+
+
+def file_hash(filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), ''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def code_version(func):
+    """Returns a hash of the source file of the module defining func."""
+    source = sys.modules[func.__module__].__file__
+    if source.endswith(('.pyc', '.pyo')):
+        source = source[:-1]
+    with open(source, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def cache_key(func, filename, kwargs=None, use_hash=False, version=None):
+    if use_hash:
+        identity = ['sha1', file_hash(filename)]
+    else:
+        info = os.stat(filename)
+        identity = [os.path.abspath(filename), info.st_size, info.st_mtime]
+    parts = identity + ['{0}.{1}'.format(func.__module__, func.__name__),
+                        code_version(func), kwargs or {},
+                        version if version is not None
+                        else data.cleaning_rules.version]
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+class Cache(object):
+
+    def __init__(self, path=CACHE_DIR, max_size=MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+    def get(self, key):
+        """Returns (True, result) for a stored key, or (False, None)."""
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+        # Mark as recently used for evict()
+        os.utime(filename, None)
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.filename(key))
+        self.evict()
+
+    def entries(self):
+        """Returns [(last used, size, filename), ...] of the stored results."""
+        found = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pickle'):
+                filename = os.path.join(self.path, name)
+                try:
+                    info = os.stat(filename)
+                except OSError:
+                    continue
+                found.append((info.st_mtime, info.st_size, filename))
+        return found
+
+    def evict(self):
+        """Removes the least recently used results until under max_size."""
+        found = sorted(self.entries())
+        total = sum(size for __, size, __ in found)
+        for __, size, filename in found:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for __, __, filename in self.entries():
+            os.remove(filename)
+
+
+default_cache = Cache()
+
+
+def cached(func, filename, use_hash=False, version=None, cache=None, **kwargs):
+    """
+    Returns func(filename, **kwargs), from the cache if it was stored for
+    the same file, function, arguments and rule version before.
+    """
+    cache = cache or default_cache
+    key = cache_key(func, filename, kwargs, use_hash, version)
+    hit, result = cache.get(key)
+    if not hit:
+        result = func(filename, **kwargs)
+        cache.put(key, result)
+    return result
+
+
+def test():
+    import shutil
+    import audit #local *.py file
+    import generate #local *.py file
+    import mapparser #local *.py file
+    import rules #local *.py file
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'map.osm')
+        generate.generate(filename, 2 << 20, seed=3)
+        cache = Cache(os.path.join(tmp, 'cache'))
+        first = cached(audit.audit, filename, cache=cache)
+        assert cached(audit.audit, filename, cache=cache) == first
+        assert cache.hits == 1
+        tags = cached(mapparser.count_tags, filename, cache=cache)
+        assert cached(mapparser.count_tags, filename, cache=cache, fast=True) == tags
+        assert cache.misses == 3
+        assert cached(mapparser.count_tags, filename, cache=cache, version='new') == tags
+        assert cache.misses == 4
+        # Rules switched on with data.use_rules() are a new key
+        custom = rules.load()
+        custom['drop_keys'].append('name')
+        data.use_rules(rules.compile(custom))
+        try:
+            cached(mapparser.count_tags, filename, cache=cache)
+            assert cache.misses == 5
+        finally:
+            data.use_rules(rules.compile(rules.load()))
+        cached(mapparser.count_tags, filename, cache=cache)
+        assert cache.misses == 5
+        # A changed file is a new key
+        os.utime(filename, (0, 0))
+        cached(mapparser.count_tags, filename, cache=cache)
+        assert cache.misses == 6
+        # Only the most recently used result fits
+        newest = max(cache.entries())
+        cache.max_size = newest[1]
+        cache.evict()
+        assert cache.entries() == [newest]
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test()
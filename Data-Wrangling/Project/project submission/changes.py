@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# changes.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Applies OpenStreetMap change files (OsmChange, *.osc or *.osc.gz) to a
+collection loaded from data.process_map, instead of reprocessing the whole
+map file. A change file looks like this:
+
+<osmChange version="0.6">
+  <create> <node id="1" .../> </create>
+  <modify> <way id="2" ...> <nd ref="1"/> </way> </modify>
+  <delete> <node id="3" .../> </delete>
+</osmChange>
+
+Created and modified nodes and ways are cleaned with data.shape_element() and
+replaced (or inserted) by their "id" and "type". Deleted ones are removed.
+The operations are sent with ordered bulk_write() calls, so a change file that
+creates and then deletes an element leaves it deleted.
+
+Replication diffs are numbered. apply_changes() records the sequence number of
+the last diff it applied in a small JSON state file, and skips any diff at or
+below that number when run again.
+"""
+from pymongo import ReplaceOne, DeleteOne
+import xml.etree.cElementTree as ET
+import gzip
+import json
+import os
+import data #local *.py file
+
+ACTIONS = ("create", "modify", "delete")
+BATCH_SIZE = 1000
+
+
+def open_changes(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def iter_changes(filename):
+    """
+    Yields (action, element) for every element of the change file, where
+    action is 'create', 'modify' or 'delete'.
+    """
+    f = open_changes(filename)
+    try:
+        action = None
+        depth = 0
+        parent = None
+        parser = ET.iterparse(f, events=("start", "end"))
+        for event, elem in parser:
+            if event == "start":
+                depth += 1
+                if depth == 2:
+                    action = elem.tag
+                    parent = elem
+                continue
+            depth -= 1
+            if depth == 2 and action in ACTIONS:
+                yield action, elem
+                # Safe to clear() now that the element has been processed
+                elem.clear()
+                parent.clear()
+        del parser
+    finally:
+        f.close()
+
+
+def change_ops(filename):
+    """Yields a pymongo bulk operation for each node and way change."""
+    for action, elem in iter_changes(filename):
+        if elem.tag not in ("node", "way"):
+            continue
+        if action == "delete":
+            yield DeleteOne({'id': elem.attrib['id'], 'type': elem.tag})
+        else:
+            el = data.shape_element(elem)
+            yield ReplaceOne({'id': el['id'], 'type': el['type']}, el, upsert=True)
+
+
+def read_state(state_file):
+    """Returns the saved replication state, or {} if there is none yet."""
+    if not state_file or not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def write_state(state_file, state):
+    # Write a new file and rename it, so a crash never leaves half a state
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp, state_file)
+
+
+def apply_changes(filename, collection, sequence=None, state_file=None,
+                  batch_size=BATCH_SIZE):
+    """
+    Applies the change file to collection. Returns a dictionary counting the
+    upserted, modified and deleted documents, or None if the state file shows
+    that diff 'sequence' was already applied.
+    """
+    state = read_state(state_file)
+    if sequence is not None and state.get('sequence', -1) >= sequence:
+        return None
+    collection.create_index([('id', 1), ('type', 1)])
+    counts = {'upserted': 0, 'modified': 0, 'deleted': 0}
+    ops = []
+
+    def flush():
+        result = collection.bulk_write(ops, ordered=True)
+        counts['upserted'] += result.upserted_count
+        counts['modified'] += result.modified_count
+        counts['deleted'] += result.deleted_count
+        del ops[:]
+
+    for op in change_ops(filename):
+        ops.append(op)
+        if len(ops) >= batch_size:
+            flush()
+    if ops:
+        flush()
+    if state_file and sequence is not None:
+        write_state(state_file, {'sequence': sequence,
+                                 'file': os.path.basename(filename)})
+    return counts
+
+
+class MockResult(object):
+
+    def __init__(self):
+        self.upserted_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+
+
+class MockCollection(object):
+    """
+    Stands in for a pymongo collection in test(). Applies the operations of
+    each bulk_write() call to a dictionary keyed by the filter's "id" and
+    "type", and records the calls.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.indexes = []
+        self.calls = []
+
+    def create_index(self, keys):
+        self.indexes.append(keys)
+
+    def bulk_write(self, ops, ordered=True):
+        self.calls.append((list(ops), ordered))
+        result = MockResult()
+        for op in ops:
+            key = (op._filter['id'], op._filter['type'])
+            if isinstance(op, DeleteOne):
+                if self.docs.pop(key, None) is not None:
+                    result.deleted_count += 1
+            elif key in self.docs:
+                self.docs[key] = op._doc
+                result.modified_count += 1
+            else:
+                self.docs[key] = op._doc
+                result.upserted_count += 1
+        return result
+
+
+EXAMPLE_CHANGES = """<osmChange version="0.6">
+  <create>
+    <node id="1" lat="35.1" lon="-80.8" version="1" user="alice" uid="7">
+      <tag k="addr:street" v="W 9th St"/>
+    </node>
+    <node id="3" lat="35.2" lon="-80.9" version="1"/>
+  </create>
+  <modify>
+    <way id="2" version="2"><nd ref="1"/><nd ref="3"/><tag k="name" v="Elm"/></way>
+    <node id="1" lat="35.1" lon="-80.8" version="2">
+      <tag k="addr:street" v="W 9th St"/>
+      <tag k="amenity" v="cafe"/>
+    </node>
+  </modify>
+  <delete>
+    <node id="3" version="2"/>
+    <way id="9" version="3"/>
+  </delete>
+</osmChange>
+"""
+
+
+def main_test():
+    from pymongo import MongoClient
+    db = MongoClient("mongodb://localhost:27017").examples
+    counts = apply_changes('example.osc', db.osm, sequence=1,
+                           state_file='example.state.json')
+    print counts
+    assert read_state('example.state.json')['sequence'] == 1
+    assert apply_changes('example.osc', db.osm, sequence=1,
+                         state_file='example.state.json') is None
+    os.remove('example.state.json')
+
+
+def test():
+    import tempfile
+    import shutil
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'example.osc')
+        with open(filename, 'w') as f:
+            f.write(EXAMPLE_CHANGES)
+        state_file = os.path.join(tmp, 'state.json')
+        collection = MockCollection()
+        counts = apply_changes(filename, collection, sequence=5,
+                               state_file=state_file, batch_size=2)
+        assert counts == {'upserted': 3, 'modified': 1, 'deleted': 1}
+        assert collection.indexes == [[('id', 1), ('type', 1)]]
+        # Batches are sent in file order, each one ordered
+        assert [len(ops) for ops, __ in collection.calls] == [2, 2, 2]
+        assert all(ordered is True for __, ordered in collection.calls)
+        ops = [op for batch, __ in collection.calls for op in batch]
+        assert [op._filter for op in ops] == [
+            {'id': '1', 'type': 'node'}, {'id': '3', 'type': 'node'},
+            {'id': '2', 'type': 'way'}, {'id': '1', 'type': 'node'},
+            {'id': '3', 'type': 'node'}, {'id': '9', 'type': 'way'}]
+        assert [type(op) for op in ops] == [ReplaceOne] * 4 + [DeleteOne] * 2
+        assert all(op._upsert for op in ops[:4])
+        # Created and then deleted is gone, modified replaces the document
+        assert sorted(collection.docs) == [('1', 'node'), ('2', 'way')]
+        node = collection.docs[('1', 'node')]
+        assert node['amenity'] == 'cafe' and node['created']['version'] == '2'
+        assert node['address'] == {'street': 'West 9th Street'}
+        assert collection.docs[('2', 'way')]['node_refs'] == ['1', '3']
+        # The state file makes a second run of the same diff a no-op
+        assert read_state(state_file) == {'sequence': 5, 'file': 'example.osc'}
+        assert apply_changes(filename, collection, sequence=5,
+                             state_file=state_file) is None
+        assert apply_changes(filename, collection, sequence=4,
+                             state_file=state_file) is None
+        assert len(collection.calls) == 3 and len(collection.indexes) == 1
+        # A new diff is applied again, now over the existing documents
+        assert apply_changes(filename, collection, sequence=6,
+                             state_file=state_file) == {
+            'upserted': 1, 'modified': 3, 'deleted': 1}
+        assert read_state(state_file)['sequence'] == 6
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test()
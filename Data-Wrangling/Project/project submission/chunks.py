@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# chunks.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Splits an OSM XML file into byte ranges that start on a top level "<node",
+"<way" or "<relation" tag, so that each range can be parsed on its own.
+
+split() returns a list of (start, end) byte offsets covering every top level
+element of the file. Everything before the first element (the XML declaration,
+"<osm>" and "<bounds>") and the closing "</osm>" fall outside of the ranges.
+
+RangeReader is a file-like object that wraps one range in "<osm>" and "</osm>"
+so it can be handed straight to ET.iterparse, and iter_range() yields the
+completed top level elements of a range.
+"""
+import os
+import re
+import osmstream #local *.py file
+
+BLOCK_SIZE = 1 << 20
+CHUNK_SIZE = 64 << 20
+
+element_start = re.compile(r'<(?:node|way|relation)[\s/>]')
+osm_end = '</osm>'
+
+
+def find_boundary(f, offset, limit):
+    """
+    Returns the offset of the first top level element starting at or after
+    offset, or limit if there is none before it.
+    """
+    f.seek(offset)
+    pos = offset
+    # Overlap reads so a tag split across two blocks is still found
+    tail = ''
+    while pos < limit:
+        block = f.read(min(BLOCK_SIZE, limit - pos))
+        if not block:
+            break
+        buf = tail + block
+        m = element_start.search(buf)
+        if m:
+            return pos - len(tail) + m.start()
+        tail = buf[-16:]
+        pos += len(block)
+    return limit
+
+
+def find_end(f, size):
+    """Returns the offset of the closing '</osm>' tag."""
+    step = min(size, BLOCK_SIZE)
+    f.seek(size - step)
+    i = f.read(step).rfind(osm_end)
+    if i == -1:
+        return size
+    return size - step + i
+
+
+def split(filename, chunk_size=CHUNK_SIZE, offset=0):
+    """
+    Returns (start, end) byte ranges of about chunk_size bytes each,
+    starting with the first element at or after offset.
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    with open(filename, 'rb') as f:
+        end = find_end(f, size)
+        start = find_boundary(f, offset, end)
+        while start < end:
+            stop = find_boundary(f, min(start + chunk_size, end), end)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+class RangeReader(object):
+    """Reads bytes start:end of filename wrapped in an <osm> root element."""
+
+    def __init__(self, filename, start, end):
+        self.f = open(filename, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+        self.head = '<osm>'
+        self.tail = '</osm>'
+
+    def read(self, size=BLOCK_SIZE):
+        if self.head:
+            data, self.head = self.head, ''
+            return data
+        if self.remaining > 0:
+            data = self.f.read(min(size, self.remaining))
+            self.remaining -= len(data)
+            if data:
+                return data
+            self.remaining = 0
+        data, self.tail = self.tail, ''
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def iter_range(filename, start, end):
+    """Yields the completed top level elements in bytes start:end."""
+    reader = RangeReader(filename, start, end)
+    try:
+        for elem in osmstream.iter_elements(reader):
+            yield elem
+    finally:
+        reader.close()
+
+
+def test():
+    ranges = split('example.osm', chunk_size=1 << 16)
+    assert len(ranges) > 1
+    for (__, end), (start, __) in zip(ranges, ranges[1:]):
+        assert end == start
+    count = 0
+    for start, end in ranges:
+        for elem in iter_range('example.osm', start, end):
+            count += 1
+    print count
+    assert count == 46721 + 3781 + 44
+
+
+if __name__ == "__main__":
+    test()
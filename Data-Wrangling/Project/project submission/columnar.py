@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# columnar.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Saves the shaped data as NumPy arrays, one file per column, so it can be
+loaded memory-mapped and aggregated without parsing the JSON output again.
+
+ColumnarWriter is a writer for data.process_map (see writers.py), usually
+used next to the JSON output with process_map(columnar=True). It writes a
+directory with two tables, "nodes" and "ways":
+
+- nodes.id.npy, nodes.lat.npy, nodes.lon.npy
+- ways.id.npy, plus ways.node_refs.npy (all node ids of all ways, int64) and
+  ways.node_refs_offsets.npy, where the nodes of way i are
+  node_refs[offsets[i]:offsets[i + 1]]
+- for both tables a dictionary encoded column for each key in COLUMNS:
+  '<table>.<key>.npy' holds an int32 code per row (-1 when missing) and
+  '<table>.vocab.json' the values the codes stand for
+
+    columns = load('charlotte.osm.columns')
+    amenity = columns['nodes']['amenity']
+    print amenity.counts()                  # {'school': 312, ...}
+"""
+from array import array
+import numpy as np
+import json
+import os
+
+# Dotted keys of shaped elements stored as dictionary encoded columns
+COLUMNS = ['amenity', 'address.postcode', 'address.street', 'created.uid']
+
+
+def get_value(el, key):
+    """Returns el['a']['b'] for key 'a.b', or None."""
+    for part in key.split('.'):
+        if not isinstance(el, dict):
+            return None
+        el = el.get(part)
+    return el
+
+
+class DictionaryColumn(object):
+    """Builds a dictionary encoded column one value at a time."""
+
+    def __init__(self):
+        self.codes = array('i')
+        self.index = {}
+        self.values = []
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+
+class Table(object):
+
+    def __init__(self, keys):
+        self.ids = array('l')
+        self.columns = dict((key, DictionaryColumn()) for key in keys)
+
+    def add(self, el):
+        self.ids.append(int(el['id']))
+        for key, column in self.columns.items():
+            column.append(get_value(el, key))
+
+    def save(self, path, name, arrays):
+        arrays['id'] = np.frombuffer(self.ids, dtype='i{0}'.format(self.ids.itemsize)).astype(np.int64)
+        vocab = {}
+        for key, column in self.columns.items():
+            arrays[key] = np.frombuffer(column.codes, dtype=np.int32)
+            vocab[key] = column.values
+        for key, values in arrays.items():
+            np.save(os.path.join(path, '{0}.{1}.npy'.format(name, key)), values)
+        with open(os.path.join(path, '{0}.vocab.json'.format(name)), 'w') as f:
+            json.dump(vocab, f)
+
+
+class ColumnarWriter(object):
+
+    def __init__(self, path, keys=COLUMNS):
+        self.path = path
+        self.nodes = Table(keys)
+        self.ways = Table(keys)
+        self.lats = array('d')
+        self.lons = array('d')
+        self.refs = array('l')
+        self.offsets = array('l', [0])
+
+    def write(self, el):
+        if el['type'] == 'node':
+            self.nodes.add(el)
+            lat, lon = el.get('pos') or (np.nan, np.nan)
+            self.lats.append(lat)
+            self.lons.append(lon)
+        elif el['type'] == 'way':
+            self.ways.add(el)
+            self.refs.extend(int(ref) for ref in el.get('node_refs', ()))
+            self.offsets.append(len(self.refs))
+
+    def close(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.nodes.save(self.path, 'nodes',
+                        {'lat': np.frombuffer(self.lats, dtype=np.float64),
+                         'lon': np.frombuffer(self.lons, dtype=np.float64)})
+        size = 'i{0}'.format(self.refs.itemsize)
+        self.ways.save(self.path, 'ways',
+                       {'node_refs': np.frombuffer(self.refs, dtype=size).astype(np.int64),
+                        'node_refs_offsets': np.frombuffer(self.offsets, dtype=size).astype(np.int64)})
+
+
+class EncodedColumn(object):
+    """A loaded dictionary encoded column."""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def counts(self):
+        """Returns {value: number of rows} using one vectorized pass."""
+        counts = np.bincount(self.codes[self.codes >= 0], minlength=len(self.values))
+        return dict((value, int(n)) for value, n in zip(self.values, counts) if n)
+
+    def equals(self, value):
+        """Returns a boolean mask of the rows holding value."""
+        try:
+            return self.codes == self.values.index(value)
+        except ValueError:
+            return np.zeros(len(self.codes), dtype=bool)
+
+    def decode(self):
+        """Returns the column as a list of values (None when missing)."""
+        values = self.values
+        return [values[code] if code >= 0 else None for code in self.codes]
+
+
+def load(path, mmap=True):
+    """
+    Returns {'nodes': {...}, 'ways': {...}} mapping column names to arrays,
+    or to EncodedColumns for the dictionary encoded ones.
+    """
+    mode = 'r' if mmap else None
+    tables = {}
+    for name in ('nodes', 'ways'):
+        with open(os.path.join(path, '{0}.vocab.json'.format(name))) as f:
+            vocab = json.load(f)
+        table = {}
+        prefix = name + '.'
+        for filename in os.listdir(path):
+            if filename.startswith(prefix) and filename.endswith('.npy'):
+                key = filename[len(prefix):-4]
+                values = np.load(os.path.join(path, filename), mmap_mode=mode)
+                table[key] = EncodedColumn(values, vocab[key]) if key in vocab else values
+        tables[name] = table
+    return tables
+
+
+def bounding_box(columns):
+    """Returns [min lat, min lon, max lat, max lon] of all nodes."""
+    lat = columns['nodes']['lat']
+    lon = columns['nodes']['lon']
+    return [float(np.nanmin(lat)), float(np.nanmin(lon)),
+            float(np.nanmax(lat)), float(np.nanmax(lon))]
+
+
+def example_test():
+    import data #local *.py file
+    data.process_map('example.osm', columnar=True)
+    columns = load('example.osm.columns')
+    assert len(columns['nodes']['id']) == 46721
+    assert len(columns['ways']['id']) == 3781
+    offsets = columns['ways']['node_refs_offsets']
+    assert offsets[-1] == len(columns['ways']['node_refs']) == 52969
+    print bounding_box(columns)
+    print columns['nodes']['amenity'].counts()
+
+
+if __name__ == "__main__":
+    example_test()
@@ -83,18 +83,34 @@ In particular the following occurs:
 
 "node_refs": ["305896090", "1719825889"]
 """
-import xml.etree.cElementTree as ET
-import codecs
+import multiprocessing
 import pprint
 import json
+import os
 import re
-import audit #local *.py file
+import chunks #local *.py file
+import instrument #local *.py file
+import osmstream #local *.py file
+import pbf #local *.py file
+import rules #local *.py file
+import writers #local *.py file
 
 lower = re.compile(r'^([a-z]|_)*$')
 lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
-CREATED = ["version", "changeset", "timestamp", "user", "uid"]
+CREATED = frozenset(["version", "changeset", "timestamp", "user", "uid"])
+
+# Classes of second level tag "k" values, see classify_key()
+PROBLEM, IGNORED, ADDRESS, TIGER, RENAME, MAPPED, PLAIN = range(7)
+# The function shape_element() calls for each key, see key_action()
+key_actions = {}
+
+# Key drops, renames and value fixes from rules.json, see use_rules()
+cleaning_rules = rules.compile(rules.load())
+
+# Counters for the cleaning branches, see instrument.py
+run_stats = instrument.NULL
 
 
 def get_pos(element):
@@ -105,55 +121,92 @@ def get_pos(element):
     return pos
 
 
+def use_rules(compiled):
+    """Cleans with compiled rules (see rules.py) from now on."""
+    global cleaning_rules
+    cleaning_rules = compiled
+    key_actions.clear()
+
+
 def ignoring(k):
     """Returns True if key k should be ignored."""
-    KEYS = ['ele', 'import_uuid', 'source', 'wikipedia']
-    PREFIXES = ['gnis:', 'is_in', 'nhd-s']
-    if k in KEYS or k[:5] in PREFIXES:
-        return True
-    return False
+    return cleaning_rules.dropped(k)
+
+
+def classify_key(k):
+    """
+    Returns the class of tag key k (PROBLEM, IGNORED, ADDRESS, TIGER,
+    RENAME, MAPPED or PLAIN). Only called by key_action(), which remembers
+    the handler of each key, so every distinct key is classified once.
+    """
+    if problemchars.search(k):
+        cls = PROBLEM
+    elif ignoring(k):
+        cls = IGNORED
+    elif k.startswith('tiger:'):
+        cls = TIGER
+    elif k.startswith('addr:'):
+        # Ignore 'addr:street:' keys with 2 colons
+        cls = ADDRESS if k.count(':') == 1 else IGNORED
+    elif k in cleaning_rules.renamed_keys:
+        cls = RENAME
+    elif k in cleaning_rules.value_maps:
+        cls = MAPPED
+    else:
+        cls = PLAIN
+    return cls
 
 
 def fix_postcode(v):
     """
-    Reduces postcodes to 5 digit strings. Some zips take the form
-    'NC12345' or '12345-6789' hindering MongoDB aggregations.
+    Reduces postcodes to 5 digit strings (postcode_digits in rules.json).
+    Some zips take the form 'NC12345' or '12345-6789' hindering MongoDB
+    aggregations.
     """
-    postcode = ''
-    for char in v:
-        if char.isdigit():
-            postcode += char
-        if len(postcode) == 5:
-            break
-    return postcode
+    return cleaning_rules.fix_postcode(v)
                     
 
-def node_update_k(node, value, tag):
-    """Adds 'k' and 'v' values from tag as new key:value pair to node."""
-    k = value
-    v = tag.attrib['v']                       
-    if k.startswith('addr:'):
-        # Ignore 'addr:street:' keys with 2 colons
-        if k.count(':') == 1:
-            if 'address' not in node:
-                node['address'] = {}
-            if k == 'addr:postcode' and len(v) > 5:
-                v = fix_postcode(v)
-            # Fix all substrings of street names using a
-            # more generalized update method from audit.py
-            elif k == 'addr:street':
-                v = audit.update(v, audit.mapping)
-            node['address'][k[5:]] = v
-    # Check for highway exit number nodes
-    elif k == 'ref' and node['type'] == 'node':
-        node['exit_number'] = v
-    # Check for 'k' values that equal the string 'type'
-    # which would overwrite previously written node['type']
-    elif k == 'type':
-        node['service_type'] = v
+def update_address(node, k, tag):
+    """Adds an 'addr:__' value from tag to node['address']."""
+    v = tag.attrib['v']
+    if k in cleaning_rules.value_maps:
+        v = cleaning_rules.value_maps[k].get(v, v)
+    if 'address' not in node:
+        node['address'] = {}
+    if k == 'addr:postcode' and len(v) > cleaning_rules.postcode_digits:
+        v = fix_postcode(v)
+        run_stats.count('postcode_fixes')
+    # Fix all substrings of street names using a
+    # more generalized update method from audit.py
+    elif k == 'addr:street':
+        better_v = cleaning_rules.normalizer(v)
+        if better_v != v:
+            run_stats.count('street_fixes')
+        v = better_v
+    node['address'][k[5:]] = v
+    return node
+
+
+def update_rename(node, k, tag):
+    # 'type' would overwrite node['type'], and 'ref' on a node is
+    # a highway exit number, see rename_keys in rules.json
+    v = tag.attrib['v']
+    if k in cleaning_rules.value_maps:
+        v = cleaning_rules.value_maps[k].get(v, v)
+    node[cleaning_rules.renames[node['type']].get(k, k)] = v
+    return node
+
+
+def update_mapped(node, k, tag):
+    # Replace values listed in value_maps
+    v = tag.attrib['v']
+    node[k] = cleaning_rules.value_maps[k].get(v, v)
+    return node
+
+
+def update_plain(node, k, tag):
     # Process other k:v pairs normally
-    else:
-        node[k] = v
+    node[k] = tag.attrib['v']
     return node
 
 
@@ -165,6 +218,7 @@ def process_tiger(node, value, tag):
     name_segments = ['name_type', 'name_base', 'name_direction_prefix', 
                      'name_direction_suffix', 'name_direction_suffix_1']
     k = value[6:]  # the substring following 'tiger:'
+    run_stats.count('tiger')
     v = tag.attrib['v']
     if 'address' not in node:
         node['address'] = {}           
@@ -183,16 +237,48 @@ def process_tiger(node, value, tag):
 def join_segments(s):
     """
     Joins 'tiger:__' street name substring values (prefix, base,
-    type, suffix) in dict s to a string
+    type, suffix) in dict s to a string, fixing abbreviations
+    the same way as 'addr:street' values
     """
-    for segment in s:
-        if segment in audit.mapping:
-            s[segment] = audit.mapping[segment]
     ordered = [ s['name_direction_prefix'], s['name_base'],
                 s['name_type'], s['name_direction_suffix'],
                 s['name_direction_suffix_1'] ]
     segments = [s for s in ordered if s]
-    return ' '.join(segments)
+    return cleaning_rules.normalizer(' '.join(segments))
+
+
+# Handler for each class of tag key, looked up by key_action()
+key_handlers = {ADDRESS: update_address,
+                TIGER: process_tiger,
+                RENAME: update_rename,
+                MAPPED: update_mapped,
+                PLAIN: update_plain}
+
+
+def update_problem(node, k, tag):
+    # Keys with problem characters are kept as node['k']
+    run_stats.count('problem_keys')
+    node['k'] = k
+    return node
+
+
+def skip_ignored(node, k, tag):
+    run_stats.count('ignored_keys')
+    return node
+
+
+def key_action(k):
+    """
+    Returns the handler of the class of key k, or update_problem or
+    skip_ignored, remembered in key_actions so shape_element() finds it
+    with a single lookup.
+    """
+    cls = classify_key(k)
+    action = key_handlers.get(cls)
+    if action is None:
+        action = update_problem if cls == PROBLEM else skip_ignored
+    key_actions[k] = action
+    return action
 
 
 def shape_element(element):
@@ -213,21 +299,18 @@ def shape_element(element):
             for key, value in tag.items():
                 if key in CREATED:
                     node['created'][key] = value
-                # Check for problem characters and ignored values
-                # in second-level tag 'k' attribute
-                elif key == 'k' and not re.search(problemchars, value):
-                    if not ignoring(value):
-                        if value.startswith('tiger:'):
-                            node = process_tiger(node, value, tag)
-                        else:
-                            node = node_update_k(node, value, tag)
+                # Dispatch on the class of the second-level tag 'k'
+                # attribute, see key_action()
+                elif key == 'k':
+                    action = key_actions.get(value) or key_action(value)
+                    node = action(node, value, tag)
                 # Create/update array 'node_refs'
                 elif key == 'ref':
                     if 'node_refs' not in node:
                         node['node_refs'] = []
                     node['node_refs'].append(value)
                 # Process remaining tags
-                elif key not in ['v', 'lat', 'lon']:
+                elif key not in ('v', 'lat', 'lon'):
                     node[key] = value
         if 'address' in node and 'street' in node['address']:
             if isinstance(node['address']['street'], dict):
@@ -240,27 +323,349 @@ def shape_element(element):
         return None
 
 
-def process_map(file_in, pretty = False):
+def process_map(file_in, pretty = False, workers = None, shards = False,
+                compress = None, fast = False, writer = None,
+                geometry = False, node_index = None,
+                checkpoint = False, resume = False, stats = None,
+                columnar = False, spatial = False, pipeline = None):
     """
     Outputs a JSON file with the above structure.
-    Returns the data as a list of dictionaries.
-    If running main_test(), comment out all array 'data' operations.
+    Returns the number of documents written, whichever way the file is
+    processed.
+    Pass workers (or shards=True) to shape the file in a process pool,
+    see process_map_parallel(). PBF files (*.osm.pbf) are decoded in a
+    pool of workers processes instead and shaped here.
+    The output is written by a writers.JSONWriter, gzip or zstd compressed
+    if compress is 'gzip' or 'zstd', and serialized with a faster JSON
+    module if fast is True. Any other writer can be passed in instead,
+    except with shards=True, which writes its own files.
+    With geometry=True ways get 'coords', 'centroid' and 'bbox' values from
+    a node location index saved as '<file_in>.nodes.*.npy' (see
+    nodeindex.py). node_index is the path of an index built before.
+    With checkpoint=True (or resume=True) progress is saved as it goes, see
+    process_map_checkpointed(). Checkpoints write plain JSON to
+    '<file_in>.json' in one process, so they raise ValueError together with
+    compress, writer, columnar, spatial, stats, pipeline, workers or shards.
+    Pass an instrument.Stats object as stats to time each stage of a
+    sequential run and count the cleaning branches. The stages of an XML
+    file shaped in a process pool cannot be timed, so stats raises
+    ValueError together with workers or shards there.
+    With columnar=True the data is also saved as NumPy columns in
+    '<file_in>.columns' (see columnar.py), which needs a single output, so
+    it raises ValueError with shards=True.
+    With spatial=True a grid index of node positions and their offsets in
+    the output is saved as '<file_out>.grid.npz' (see spatial.py). The
+    offsets are those of a single output, so shards=True raises ValueError.
+    Pass a pipeline.Pipeline as pipeline to read, shape and write in three
+    threads; its report() shows which of them is the bottleneck. It raises
+    ValueError together with stats, or with workers or shards on an XML
+    file, since those runs shape the file another way.
     """
-    file_out = "{0}.json".format(file_in)
-    #data = []
-    with codecs.open(file_out, "w") as fo:
-        parser = ET.iterparse(file_in)
-        for __, elem in parser:
-            el = shape_element(elem)
+    if checkpoint or resume:
+        unsupported = [name for name, value in (('compress', compress),
+                                                ('writer', writer is not None),
+                                                ('columnar', columnar),
+                                                ('spatial', spatial),
+                                                ('stats', stats is not None),
+                                                ('pipeline', pipeline is not None),
+                                                ('workers', workers),
+                                                ('shards', shards)) if value]
+        if unsupported:
+            raise ValueError('Checkpoints do not support {0}'.format(
+                ', '.join(unsupported)))
+        return process_map_checkpointed(file_in, pretty, fast, resume,
+                                        geometry, node_index)
+    if shards:
+        unsupported = [name for name, value in (('writer', writer is not None),
+                                                ('columnar', columnar),
+                                                ('spatial', spatial)) if value]
+        if unsupported:
+            raise ValueError('shards do not support {0}'.format(
+                ', '.join(unsupported)))
+    if stats is not None and (workers or shards) and not pbf.is_pbf(file_in):
+        raise ValueError('stats needs a sequential run of an XML file')
+    if pipeline is not None:
+        if stats is not None:
+            raise ValueError('pipeline cannot be combined with stats')
+        if (workers or shards) and not pbf.is_pbf(file_in):
+            raise ValueError('pipeline needs a sequential run of an XML file')
+    if columnar or spatial:
+        if writer is None:
+            file_out = writers.output_name("{0}.json".format(file_in), compress)
+            writer = writers.JSONWriter(file_out, pretty, fast)
+        if columnar:
+            import columnar as columns #local *.py file
+            writer = writers.Tee(writer, columns.ColumnarWriter("{0}.columns".format(file_in)))
+        if spatial:
+            import spatial as grid #local *.py file
+            writer = grid.IndexedWriter(writer, "{0}.grid.npz".format(writer.file_out))
+    if (workers or shards) and not pbf.is_pbf(file_in):
+        return process_map_parallel(file_in, pretty, workers, shards,
+                                    compress, fast, writer,
+                                    geometry, node_index)
+    if writer is None:
+        file_out = writers.output_name("{0}.json".format(file_in), compress)
+        writer = writers.JSONWriter(file_out, pretty, fast)
+    way_geometry = None
+    if geometry or node_index:
+        import nodeindex #local *.py file
+        if node_index:
+            way_geometry = nodeindex.WayGeometry(index=nodeindex.NodeIndex(node_index))
+        else:
+            way_geometry = nodeindex.WayGeometry("{0}.nodes".format(file_in))
+    count = 0
+    try:
+        if stats is not None:
+            count = shape_instrumented(file_in, workers, writer, way_geometry, stats)
+        elif pipeline is not None:
+            pipeline.run(file_in, lambda elem: shape_geometry(elem, way_geometry),
+                         writer.write, workers)
+            count = pipeline.stats['write'].items
+        else:
+            for elem in osmstream.iter_elements(file_in, workers=workers):
+                el = shape_element(elem)
+                if el:
+                    if way_geometry:
+                        way_geometry.add(el)
+                    # Output to JSON
+                    writer.write(el)
+                    count += 1
+        if way_geometry:
+            # Saves the node index of a file without ways
+            way_geometry.close()
+    finally:
+        writer.close()
+    return count
+
+
+def shape_geometry(elem, way_geometry):
+    """shape_element(), adding the way geometry if way_geometry is given."""
+    el = shape_element(elem)
+    if el and way_geometry:
+        way_geometry.add(el)
+    return el
+
+
+def shape_instrumented(file_in, workers, writer, way_geometry, stats):
+    """
+    The loop of process_map(), timing each stage in stats. Parsing, shaping,
+    street name fixes and the writer are wrapped in timers for the run only,
+    so the plain loop above stays as fast as before, and the writer gets
+    its own methods back at the end. Returns the number of documents
+    written.
+    """
+    global run_stats
+    count = 0
+    f = None
+    source = file_in
+    if not pbf.is_pbf(file_in):
+        f = source = instrument.CountingReader(open(file_in, 'rb'), stats)
+    elements = osmstream.iter_elements(source, workers=workers)
+    next_element = stats.wrap('parse', next)
+    shape = stats.wrap('shape', shape_element)
+    normalizer = cleaning_rules.normalizer
+    cleaning_rules.normalizer = stats.wrap('street', normalizer)
+    if hasattr(writer, 'encode'):
+        timed = (('encode', 'serialize'), ('flush', 'write'))
+    else:
+        timed = (('write', 'write'),)
+    # Methods set on the writer itself, rather than by its class
+    own = dict((name, writer.__dict__[name]) for name, __ in timed
+               if name in writer.__dict__)
+    for name, stage in timed:
+        setattr(writer, name, stats.wrap(stage, getattr(writer, name)))
+    run_stats = stats
+    try:
+        while True:
+            elem = next_element(elements, None)
+            if elem is None:
+                break
+            stats.element()
+            el = shape(elem)
             if el:
-                #data.append(el)
-                # Output to JSON
-                if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
+                if way_geometry:
+                    way_geometry.add(el)
+                writer.write(el)
+                count += 1
+        if hasattr(writer, 'encode'):
+            # The last lines, which close() would write untimed
+            writer.flush()
+    finally:
+        run_stats = instrument.NULL
+        cleaning_rules.normalizer = normalizer
+        for name, __ in timed:
+            if name in own:
+                setattr(writer, name, own[name])
+            else:
+                delattr(writer, name)
+        if f is not None:
+            f.close()
+    if f is None:
+        stats.bytes_read = os.path.getsize(file_in)
+    return count
+
+
+def read_checkpoint(file_in, checkpoint_file):
+    """
+    Returns the saved checkpoint, or None if there is none or the
+    input file has changed since it was written.
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file) as f:
+        state = json.load(f)
+    info = os.stat(file_in)
+    if state['input_size'] != info.st_size or state['input_mtime'] != info.st_mtime:
+        return None
+    return state
+
+
+def write_checkpoint(checkpoint_file, state):
+    # Write a new file and rename it, so a crash never leaves half a checkpoint
+    tmp = checkpoint_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp, checkpoint_file)
+
+
+def process_map_checkpointed(file_in, pretty = False, fast = False,
+                             resume = False, geometry = False,
+                             node_index = None,
+                             checkpoint_size = chunks.CHUNK_SIZE):
+    """
+    Same output as process_map(), written in byte ranges of about
+    checkpoint_size bytes of input. After each range the output is synced
+    to disk and '<file_out>.checkpoint' records the input offset of the
+    next element, the output offset and the number of elements written.
+    With resume=True the output is cut back to the last checkpoint and
+    parsing starts again at the saved input offset. The checkpoint is
+    removed once the whole file has been processed.
+    Returns the number of documents written, counting those of the runs
+    before a resume.
+    """
+    if pbf.is_pbf(file_in):
+        raise ValueError('Checkpoints need an OSM XML file')
+    file_out = "{0}.json".format(file_in)
+    checkpoint_file = "{0}.checkpoint".format(file_out)
+    state = read_checkpoint(file_in, checkpoint_file) if resume else None
+    if state is None:
+        info = os.stat(file_in)
+        state = {'input_size': info.st_size, 'input_mtime': info.st_mtime,
+                 'input_offset': 0, 'output_offset': None, 'count': 0}
+    way_geometry = None
+    if geometry or node_index:
+        import nodeindex #local *.py file
+        if not node_index:
+            node_index = "{0}.nodes".format(file_in)
+            if state['output_offset'] is None or not os.path.exists(node_index + '.ids.npy'):
+                nodeindex.build(file_in, node_index)
+        way_geometry = nodeindex.WayGeometry(index=nodeindex.NodeIndex(node_index))
+    writer = writers.JSONWriter(file_out, pretty, fast,
+                                resume_at=state['output_offset'])
+    try:
+        for start, end in chunks.split(file_in, checkpoint_size,
+                                       state['input_offset']):
+            for elem in chunks.iter_range(file_in, start, end):
+                el = shape_element(elem)
+                if el:
+                    if way_geometry:
+                        way_geometry.add(el)
+                    writer.write(el)
+                    state['count'] += 1
+            state['output_offset'] = writer.sync()
+            state['input_offset'] = end
+            write_checkpoint(checkpoint_file, state)
+    finally:
+        writer.close()
+    os.remove(checkpoint_file)
+    return state['count']
+
+
+def shape_range(args):
+    """
+    Shapes the elements in one byte range of file_in. Returns the JSON lines
+    (or the elements themselves if encode is False), or writes them to
+    shard_out and returns the number of lines.
+    Runs in a worker process of process_map_parallel().
+    """
+    file_in, start, end, pretty, fast, encode, shard_out, node_index = args
+    way_geometry = None
+    if node_index:
+        import nodeindex #local *.py file
+        way_geometry = nodeindex.WayGeometry(index=nodeindex.NodeIndex(node_index))
+    if shard_out is not None:
+        with writers.JSONWriter(shard_out, pretty, fast) as writer:
+            for elem in chunks.iter_range(file_in, start, end):
+                el = shape_element(elem)
+                if el:
+                    if way_geometry:
+                        way_geometry.add(el)
+                    writer.write(el)
+        return writer.count
+    to_line = writers.encoder(pretty, fast)
+    results = []
+    for elem in chunks.iter_range(file_in, start, end):
+        el = shape_element(elem)
+        if el:
+            if way_geometry:
+                way_geometry.add(el)
+            results.append(to_line(el) if encode else el)
+    return results
+
+
+def process_map_parallel(file_in, pretty = False, workers = None,
+                         shards = False, compress = None, fast = False,
+                         writer = None, geometry = False, node_index = None,
+                         chunk_size = chunks.CHUNK_SIZE):
+    """
+    Same output as process_map(), but the map file is split into byte ranges
+    on element boundaries and each range is shaped in a process pool.
+    With shards=True every range is written to its own file
+    '<file_in>.<n>.json' instead of one merged file in input order, so it
+    raises ValueError if a writer is passed in as well. The writer is
+    closed when the run ends, also after an error.
+    Returns the number of documents written.
+    With geometry=True the node location index is built in a first pass,
+    since the ranges holding ways are shaped apart from the nodes.
+    """
+    if geometry and not node_index:
+        import nodeindex #local *.py file
+        node_index = nodeindex.build(file_in).path
+    ranges = chunks.split(file_in, chunk_size)
+    if shards and writer is not None:
+        raise ValueError('shards write their own files, not to writer')
+    if shards:
+        outputs = [writers.output_name("{0}.{1:05d}.json".format(file_in, i),
+                                       compress)
+                   for i in range(len(ranges))]
+    else:
+        outputs = [None] * len(ranges)
+        if writer is None:
+            file_out = writers.output_name("{0}.json".format(file_in), compress)
+            writer = writers.JSONWriter(file_out, pretty, fast)
+    # Workers serialize the lines themselves unless the writer needs elements
+    encode = hasattr(writer, 'write_line')
+    jobs = [(file_in, start, end, pretty, fast, encode, out, node_index)
+            for (start, end), out in zip(ranges, outputs)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        if shards:
+            return sum(pool.map(shape_range, jobs))
+        count = 0
+        # imap() hands results back in input order
+        for results in pool.imap(shape_range, jobs):
+            for result in results:
+                if encode:
+                    writer.write_line(result)
                 else:
-                    fo.write(json.dumps(el) + "\n")
-        del parser
-    #return data
+                    writer.write(result)
+            count += len(results)
+        return count
+    finally:
+        pool.close()
+        pool.join()
+        if writer is not None:
+            writer.close()
 
 
 def main_test():
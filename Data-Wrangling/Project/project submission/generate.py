@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# generate.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Writes synthetic OSM XML files of a given size for testing and benchmarks.
+
+The same seed and size always give the same file. The mix of elements follows
+the Charlotte extract: mostly nodes, a few of them tagged, then ways with "nd"
+references to earlier nodes, then a handful of relations with members. Tags
+include the things the cleaning code in data.py deals with:
+
+- abbreviated street names ("W 9th St", "S Tryon St Ste 105")
+- messy postcodes ("NC28209", "28209-1234")
+- TIGER street name segments and zip codes on ways
+- ignored keys ("source", "gnis:feature_id") and keys with problem characters
+"""
+import random
+import sys
+
+STREET_NAMES = ["Park", "Tryon", "Trade", "Church", "Sharon Amity", "Providence",
+                "Morehead", "Graham", "Independence", "Stanly", "9th", "Lincoln"]
+STREET_TYPES = ["St", "St.", "Street", "Ave", "Avenue", "Rd", "Road", "Dr",
+                "Blvd", "Ln", "Pky", "Hwy", "Cir", "Way"]
+PREFIXES = ["", "", "", "W", "E", "N", "S", "North"]
+AMENITIES = ["school", "restaurant", "place_of_worship", "fuel", "bank",
+             "parking", "pharmacy", "cafe", "fast_food"]
+HIGHWAYS = ["residential", "service", "tertiary", "primary", "footway"]
+USERS = 350
+
+# Bounds of the Charlotte extract
+MIN_LAT, MAX_LAT = 34.9, 35.5
+MIN_LON, MAX_LON = -81.1, -80.5
+
+
+class Generator(object):
+
+    def __init__(self, f, seed=0):
+        self.f = f
+        self.random = random.Random(seed)
+        self.written = 0
+        self.node_ids = []
+
+    def write(self, text):
+        self.f.write(text)
+        self.written += len(text)
+
+    def created(self):
+        r = self.random
+        uid = r.randint(1, USERS)
+        return ('version="{0}" timestamp="20{1:02d}-{2:02d}-{3:02d}T12:00:00Z" '
+                'changeset="{4}" uid="{5}" user="user{5}"').format(
+                    r.randint(1, 9), r.randint(8, 14), r.randint(1, 12),
+                    r.randint(1, 28), r.randint(100000, 20000000), uid)
+
+    def tag(self, k, v):
+        self.write('    <tag k="{0}" v="{1}"/>\n'.format(k, v))
+
+    def street(self):
+        r = self.random
+        name = ' '.join(s for s in [r.choice(PREFIXES), r.choice(STREET_NAMES),
+                                    r.choice(STREET_TYPES)] if s)
+        if r.random() < 0.01:
+            name += ' Ste {0}'.format(r.randint(100, 400))
+        return name
+
+    def postcode(self):
+        r = self.random
+        zip_code = '282{0:02d}'.format(r.randint(0, 99))
+        style = r.random()
+        if style < 0.1:
+            return 'NC' + zip_code
+        if style < 0.2:
+            return '{0}-{1:04d}'.format(zip_code, r.randint(0, 9999))
+        return zip_code
+
+    def node(self, node_id):
+        r = self.random
+        self.node_ids.append(node_id)
+        attrs = 'id="{0}" lat="{1:.7f}" lon="{2:.7f}" {3}'.format(
+            node_id, r.uniform(MIN_LAT, MAX_LAT), r.uniform(MIN_LON, MAX_LON),
+            self.created())
+        if r.random() < 0.9:
+            self.write('  <node {0}/>\n'.format(attrs))
+            return
+        self.write('  <node {0}>\n'.format(attrs))
+        self.tag('amenity', r.choice(AMENITIES))
+        if r.random() < 0.6:
+            self.tag('addr:housenumber', r.randint(1, 9999))
+            self.tag('addr:street', self.street())
+            self.tag('addr:postcode', self.postcode())
+        if r.random() < 0.3:
+            self.tag('name', 'Place {0}'.format(node_id))
+            if r.random() < 0.2:
+                self.tag('name_1', 'Place {0}'.format(node_id))
+        if r.random() < 0.2:
+            self.tag('source', 'survey')
+            self.tag('gnis:feature_id', r.randint(1000, 99999))
+        if r.random() < 0.1:
+            self.tag('ref', r.randint(1, 90))
+        if r.random() < 0.01:
+            self.tag('name_1 en', 'problem key')
+        self.write('  </node>\n')
+
+    def way(self, way_id):
+        r = self.random
+        self.write('  <way id="{0}" {1}>\n'.format(way_id, self.created()))
+        start = r.randint(0, len(self.node_ids) - 1)
+        for node_id in self.node_ids[start:start + r.randint(2, 12)]:
+            self.write('    <nd ref="{0}"/>\n'.format(node_id))
+        self.tag('highway', r.choice(HIGHWAYS))
+        if r.random() < 0.5:
+            street = self.street().split()
+            if r.random() < 0.5:
+                self.tag('name', ' '.join(street))
+            self.tag('tiger:county', 'Mecklenburg, NC')
+            self.tag('tiger:name_base', street[-2] if len(street) > 1 else street[0])
+            self.tag('tiger:name_type', street[-1])
+            self.tag('tiger:zip_left', self.postcode())
+            if r.random() < 0.3:
+                self.tag('tiger:name_base_1', r.choice(STREET_NAMES))
+        self.write('  </way>\n')
+
+    def relation(self, relation_id, way_ids):
+        r = self.random
+        self.write('  <relation id="{0}" {1}>\n'.format(relation_id, self.created()))
+        for way_id in r.sample(way_ids, min(len(way_ids), r.randint(2, 40))):
+            self.write('    <member type="way" ref="{0}" role="outer"/>\n'.format(way_id))
+        self.tag('type', 'multipolygon')
+        self.write('  </relation>\n')
+
+
+def generate(filename, size, seed=0):
+    """
+    Writes a synthetic OSM file of about size bytes to filename. Returns
+    the number of nodes, ways and relations written.
+    """
+    with open(filename, 'w') as f:
+        g = Generator(f, seed)
+        g.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<osm version="0.6" generator="generate.py">\n'
+                '  <bounds minlat="{0}" minlon="{1}" maxlat="{2}" maxlon="{3}"/>\n'.format(
+                    MIN_LAT, MIN_LON, MAX_LAT, MAX_LON))
+        counts = {'node': 0, 'way': 0, 'relation': 0}
+        next_id = 1
+        while g.written < 0.8 * size or not counts['node']:
+            g.node(next_id)
+            next_id += 1
+            counts['node'] += 1
+        way_ids = []
+        while g.written < 0.995 * size or not counts['way']:
+            g.way(next_id)
+            way_ids.append(next_id)
+            next_id += 1
+            counts['way'] += 1
+        while g.written < size or not counts['relation']:
+            g.relation(next_id, way_ids)
+            next_id += 1
+            counts['relation'] += 1
+        g.write('</osm>\n')
+    return counts
+
+
+def test():
+    import tempfile
+    import os
+    import mapparser #local *.py file
+    fd, filename = tempfile.mkstemp(suffix='.osm')
+    os.close(fd)
+    try:
+        counts = generate(filename, 1 << 20, seed=1)
+        tags = mapparser.count_tags(filename)
+        for tag, count in counts.items():
+            assert tags[tag] == count
+        size = os.path.getsize(filename)
+        assert (1 << 20) <= size < (1 << 20) + 4096
+        first = open(filename).read()
+        generate(filename, 1 << 20, seed=1)
+        assert open(filename).read() == first
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        print generate(sys.argv[1], int(sys.argv[2]))
+    else:
+        test()
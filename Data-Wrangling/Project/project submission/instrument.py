@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# instrument.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Optional timing and counters for data.process_map, to find out whether a run
+is bound by parsing, shaping, street name fixes, serialization or writing.
+
+Pass a Stats object to process_map(stats=...). It records:
+
+- the cumulative time spent in each stage ('parse', 'shape', 'street',
+  'serialize', 'write'). 'street' time is also part of 'shape'.
+- elements per second and input bytes read per second
+- counters for the cleaning branches in data.py ('tiger', 'postcode_fixes',
+  'street_fixes', 'ignored_keys', 'problem_keys')
+
+A progress line is printed every progress_every seconds, and finish()
+returns the final report and saves it as JSON if a report file was given.
+
+data.py counts its branches on the module level NULL object when no Stats
+object is passed in. Its methods do nothing, and the timed code paths are
+only used with a real Stats object, so the instrumentation costs next to
+nothing when it is off.
+"""
+from collections import defaultdict
+import json
+import sys
+import time
+
+
+class NullStats(object):
+    """Does nothing. Used when instrumentation is off."""
+    enabled = False
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL = NullStats()
+
+
+class CountingReader(object):
+    """File wrapper that adds the bytes read to stats.bytes_read."""
+
+    def __init__(self, f, stats):
+        self.f = f
+        self.stats = stats
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class Stats(object):
+    enabled = True
+
+    def __init__(self, progress_every=10.0, report_file=None, out=sys.stderr):
+        self.progress_every = progress_every
+        self.report_file = report_file
+        self.out = out
+        self.times = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.elements = 0
+        self.bytes_read = 0
+        self.started = time.time()
+        self.last_progress = self.started
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_time(self, stage, seconds):
+        self.times[stage] += seconds
+
+    def wrap(self, stage, func):
+        """Returns func, adding the time of every call to stage."""
+        times = self.times
+        clock = time.time
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[stage] += clock() - start
+        return timed
+
+    def element(self):
+        """Counts one element and prints a progress line when it is time."""
+        self.elements += 1
+        if self.elements & 1023 == 0:
+            now = time.time()
+            if now - self.last_progress >= self.progress_every:
+                self.last_progress = now
+                self.progress(now)
+
+    def progress(self, now=None):
+        elapsed = (now or time.time()) - self.started
+        self.out.write('{0:,} elements ({1:,.0f}/s), {2:,.1f} MB read '
+                       '({3:,.1f} MB/s)\n'.format(
+                           self.elements, self.elements / elapsed,
+                           self.bytes_read / 1e6, self.bytes_read / 1e6 / elapsed))
+
+    def report(self):
+        elapsed = time.time() - self.started
+        return {'seconds': elapsed,
+                'elements': self.elements,
+                'elements_per_sec': self.elements / elapsed if elapsed else 0.0,
+                'bytes_read': self.bytes_read,
+                'bytes_per_sec': self.bytes_read / elapsed if elapsed else 0.0,
+                'stages': dict(self.times),
+                'counters': dict(self.counters)}
+
+    def finish(self):
+        """Returns the final report, saving it to report_file if set."""
+        report = self.report()
+        if self.report_file:
+            with open(self.report_file, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        return report
+
+
+def example_test():
+    import data #local *.py file
+    stats = Stats(progress_every=1.0)
+    data.process_map('example.osm', stats=stats)
+    report = stats.finish()
+    print json.dumps(report, indent=2, sort_keys=True)
+    assert report['elements'] == 46721 + 3781 + 44
+    assert set(report['stages']) == set(['parse', 'shape', 'street',
+                                         'serialize', 'write'])
+
+
+def test():
+    import tempfile
+    import shutil
+    import os
+    import data #local *.py file
+    import generate #local *.py file
+    import writers #local *.py file
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'map.osm')
+        generate.generate(filename, 300000, seed=6)
+        writer = writers.JSONWriter(os.path.join(tmp, 'map.json'))
+        encode = writer.encode
+        stats = Stats(progress_every=60)
+        count = data.process_map(filename, writer=writer, stats=stats)
+        report = stats.finish()
+        assert report['stages']['write'] > 0
+        assert set(report['stages']) == set(['parse', 'shape', 'street',
+                                             'serialize', 'write'])
+        # The writer is left as it was, without the timers
+        assert writer.encode is encode and 'flush' not in vars(writer)
+        assert writer.count == count
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    example_test()
@@ -12,23 +12,27 @@
 Uses iterative parsing to process the map file and find out how many of each tag
 there are. The output is a dictionary with tag names as keys and the number of
 times they can be encountered in the map values.
+
+count_tags(filename, fast=True) scans the raw bytes of the file instead of
+parsing it (see bytescan.py).
 """
-import xml.etree.cElementTree as ET
 import pprint
+import bytescan #local *.py file
+import osmstream #local *.py file
+import pbf #local *.py file
 
 
-def count_tags(filename):
+def count_tags(filename, fast=False):
+    if fast and not pbf.is_pbf(filename):
+        return bytescan.count_tags(filename)
     tags = {}
-    parser = ET.iterparse(filename)
-    for __, elem in parser:
-        if elem.tag in tags:
-            tags[elem.tag] += 1
-        else:
-            tags[elem.tag] = 1
-        # It's safe to call clear() here because no
-        # descendants will be accessed
-        elem.clear()
-    del parser
+    # Streams every top level element, then the root element
+    for top in osmstream.iter_elements(filename, tags=None, root=True):
+        for elem in top.iter():
+            if elem.tag in tags:
+                tags[elem.tag] += 1
+            else:
+                tags[elem.tag] = 1
     return tags
 
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# mongosink.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Loads shaped elements straight into a MongoDB collection, without writing a
+JSON file for mongoimport first.
+
+MongoSink is a writer for data.process_map (see writers.py). write() collects
+elements into batches of batch_size documents and puts each full batch on a
+bounded queue. A background thread takes batches off the queue and inserts
+them with an unordered insert_many(), so parsing and inserting overlap, and
+parsing waits whenever queue_size batches are already waiting. The time of
+every insert is recorded, and stats() reports the batch latencies and the
+overall documents per second. Once an insert fails, the next write()
+raises its error, so a lost connection stops the run instead of being
+reported only after the whole file has been parsed.
+
+    from pymongo import MongoClient
+    db = MongoClient("mongodb://localhost:27017").osm
+    data.process_map('charlotte.osm', writer=MongoSink(db.charlotte))
+"""
+import threading
+import Queue
+import time
+
+BATCH_SIZE = 1000
+QUEUE_SIZE = 8
+
+
+class MongoSink(object):
+
+    def __init__(self, collection, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(queue_size)
+        self.batch = []
+        self.count = 0
+        self.latencies = []
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, el):
+        # Stop the caller as soon as an insert failed, not at close()
+        if self.error is not None:
+            raise self.error
+        self.batch.append(el)
+        if len(self.batch) >= self.batch_size:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def run(self):
+        """Inserts batches from the queue until it gets None."""
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            if self.error is not None:
+                # Keep draining the queue so write() never blocks
+                continue
+            start = time.time()
+            try:
+                self.collection.insert_many(batch, ordered=False)
+            except Exception as e:
+                self.error = e
+                continue
+            self.latencies.append(time.time() - start)
+            self.count += len(batch)
+
+    def close(self):
+        """Inserts the last batch and waits for the insert thread."""
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(None)
+        self.thread.join()
+        self.finished = time.time()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        elapsed = (self.finished or time.time()) - self.started
+        latencies = sorted(self.latencies)
+        result = {'docs': self.count,
+                  'batches': len(latencies),
+                  'seconds': elapsed,
+                  'docs_per_sec': self.count / elapsed if elapsed else 0.0}
+        if latencies:
+            result['batch_latency'] = {
+                'min': latencies[0],
+                'max': latencies[-1],
+                'mean': sum(latencies) / len(latencies),
+                'p95': latencies[int(0.95 * (len(latencies) - 1))]}
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MockCollection(object):
+    """
+    Stands in for a pymongo collection in test(). With fail=True every
+    insert raises, like a lost connection.
+    """
+
+    def __init__(self, fail=False):
+        self.docs = []
+        self.calls = []
+        self.fail = fail
+
+    def insert_many(self, docs, ordered=True):
+        self.calls.append((len(docs), ordered))
+        if self.fail:
+            raise IOError('connection lost')
+        self.docs.extend(docs)
+
+
+def main_test():
+    from pymongo import MongoClient
+    import data #local *.py file
+    db = MongoClient("mongodb://localhost:27017").examples
+    db.osm.drop()
+    sink = MongoSink(db.osm, batch_size=500)
+    data.process_map('example.osm', writer=sink)
+    print sink.stats()
+    assert db.osm.count() == sink.count == 46721 + 3781
+
+
+def test():
+    import tempfile
+    import shutil
+    import os
+    import data #local *.py file
+    import generate #local *.py file
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'map.osm')
+        generate.generate(filename, 1 << 20, seed=4)
+        collection = MockCollection()
+        sink = MongoSink(collection, batch_size=500, queue_size=2)
+        count = data.process_map(filename, writer=sink)
+        print sink.stats()
+        assert len(collection.docs) == sink.count == count
+        assert all(ordered is False for __, ordered in collection.calls)
+        assert max(size for size, __ in collection.calls) == 500
+        # The insert thread takes the second batch off the queue only after
+        # the first one failed, so write() raises by the fourth batch
+        sink = MongoSink(MockCollection(fail=True), batch_size=10, queue_size=1)
+        written = 0
+        try:
+            while written < 10000:
+                sink.write({'id': str(written)})
+                written += 1
+        except IOError:
+            pass
+        assert 10 <= written <= 30
+        try:
+            sink.close()
+        except IOError:
+            pass
+        else:
+            assert False
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test()
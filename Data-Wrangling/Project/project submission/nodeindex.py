@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# nodeindex.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Stores the location of every node so that ways, which only list node ids in
+their "nd" tags, can be given coordinates while the map is processed.
+
+The index is two NumPy arrays saved next to the map file:
+
+- '<path>.ids.npy': the node ids as sorted int64 values
+- '<path>.coords.npy': the latitude and longitude of each node as int32
+  values in units of 1e-7 degrees (the precision of OSM coordinates)
+
+That is 16 bytes per node. NodeIndex memory-maps both files, so only the
+pages that are used are read, and finds nodes with a binary search
+(np.searchsorted).
+
+In OSM files all nodes come before the ways, so data.process_map fills a
+NodeIndexBuilder from the nodes and saves it when it reaches the first way
+(or at the end of a file without ways).
+"""
+from array import array
+import numpy as np
+import osmstream #local *.py file
+
+SCALE = 10 ** 7
+
+
+class NodeIndexBuilder(object):
+    """Collects node locations in compact arrays until save() is called."""
+
+    def __init__(self):
+        self.ids = array('l')
+        self.coords = array('i')
+
+    def add(self, node_id, lat, lon):
+        self.ids.append(int(node_id))
+        self.coords.append(int(round(lat * SCALE)))
+        self.coords.append(int(round(lon * SCALE)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def save(self, path):
+        """Sorts the nodes by id, writes the index and returns a NodeIndex."""
+        ids = np.frombuffer(self.ids, dtype='i{0}'.format(self.ids.itemsize))
+        coords = np.frombuffer(self.coords, dtype=np.int32).reshape(-1, 2)
+        order = np.argsort(ids, kind='mergesort')
+        np.save(path + '.ids.npy', ids[order].astype(np.int64))
+        np.save(path + '.coords.npy', coords[order])
+        self.ids = array('l')
+        self.coords = array('i')
+        return NodeIndex(path)
+
+
+class NodeIndex(object):
+    """Memory-mapped, read only node location lookup."""
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = np.load(path + '.ids.npy', mmap_mode='r')
+        self.coords = np.load(path + '.coords.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, node_ids):
+        """
+        Returns an (n, 2) array of [lat, lon] for the given node ids,
+        and a boolean array telling which of them were found.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        i = np.searchsorted(self.ids, node_ids)
+        i[i == len(self.ids)] = 0
+        found = self.ids[i] == node_ids
+        coords = self.coords[i].astype(np.float64) / SCALE
+        return coords, found
+
+    def way_geometry(self, node_refs):
+        """
+        Returns the 'coords', 'centroid' and 'bbox' ([min lat, min lon,
+        max lat, max lon]) of a way from its node_refs. Nodes missing from
+        the index get None in 'coords' and are left out of the others.
+        """
+        if not node_refs or not len(self.ids):
+            return {}
+        coords, found = self.lookup([int(ref) for ref in node_refs])
+        geometry = {'coords': [[float(lat), float(lon)] if ok else None
+                               for (lat, lon), ok in zip(coords, found)]}
+        coords = coords[found]
+        if len(coords):
+            low = coords.min(axis=0)
+            high = coords.max(axis=0)
+            geometry['centroid'] = [round(float(x), 7) for x in coords.mean(axis=0)]
+            geometry['bbox'] = [float(low[0]), float(low[1]),
+                                float(high[0]), float(high[1])]
+        return geometry
+
+
+class WayGeometry(object):
+    """
+    Adds the way_geometry() of each shaped way passed to add(). Until the
+    first way arrives, the locations of shaped nodes are collected and then
+    saved to '<path>.ids.npy' and '<path>.coords.npy', or by close() if the
+    file has no ways. Pass a NodeIndex to use an index that was built before.
+    """
+
+    def __init__(self, path=None, index=None):
+        self.path = path
+        self.index = index
+        self.builder = NodeIndexBuilder() if index is None else None
+
+    def add(self, el):
+        if el['type'] == 'node':
+            if self.builder is not None and 'pos' in el:
+                self.builder.add(el['id'], el['pos'][0], el['pos'][1])
+        elif el['type'] == 'way':
+            if self.index is None:
+                self.save()
+            el.update(self.index.way_geometry(el.get('node_refs')))
+        return el
+
+    def save(self):
+        self.index = self.builder.save(self.path)
+        self.builder = None
+
+    def close(self):
+        """Saves the index if no way arrived to trigger it."""
+        if self.index is None:
+            self.save()
+
+
+def build(file_in, path=None):
+    """Builds the index for all nodes in file_in and returns it."""
+    builder = NodeIndexBuilder()
+    for elem in osmstream.iter_elements(file_in, tags=("node",)):
+        builder.add(elem.attrib['id'], float(elem.attrib['lat']),
+                    float(elem.attrib['lon']))
+    return builder.save(path or '{0}.nodes'.format(file_in))
+
+
+def example_test():
+    index = build('example.osm')
+    assert len(index) == 46721
+    coords, found = index.lookup([357796598, 1])
+    assert found.tolist() == [True, False]
+    assert coords[0].tolist() == [35.1882069, -80.8542255]
+    geometry = index.way_geometry(['2715823101', '2715823102',
+                                   '2715823103', '2715823104',
+                                   '2715823101'])
+    assert len(geometry['coords']) == 5
+    print geometry['centroid'], geometry['bbox']
+
+
+def test():
+    import tempfile
+    import shutil
+    import json
+    import os
+    import data #local *.py file
+    tmp = tempfile.mkdtemp()
+    try:
+        nodes = os.path.join(tmp, 'nodes.osm')
+        with open(nodes, 'w') as f:
+            f.write('<osm><node id="2" lat="35.5" lon="-80.5"/>'
+                    '<node id="1" lat="35.1882069" lon="-80.8542255"/></osm>')
+        data.process_map(nodes, geometry=True)
+        index = NodeIndex(nodes + '.nodes')
+        assert index.ids.tolist() == [1, 2]
+        ways = os.path.join(tmp, 'ways.osm')
+        with open(ways, 'w') as f:
+            f.write('<osm><way id="3"><nd ref="1"/><nd ref="2"/><nd ref="4"/></way></osm>')
+        data.process_map(ways, node_index=nodes + '.nodes')
+        with open(ways + '.json') as f:
+            way = json.loads(f.read())
+        assert way['coords'] == [[35.1882069, -80.8542255], [35.5, -80.5], None]
+        assert way['bbox'] == [35.1882069, -80.8542255, 35.5, -80.5]
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    example_test()
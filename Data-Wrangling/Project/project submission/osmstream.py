@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# osmstream.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Streams the top level elements of an OSM XML file in constant memory.
+
+Calling elem.clear() after each element is not enough on its own: iterparse
+builds the whole tree, so the root "<osm>" element keeps a reference to every
+(empty) child and memory still grows with the size of the file. iter_elements()
+only yields an element once its end tag has been read, so all of its "tag",
+"nd" and "member" children are there, and afterwards it clears both the element
+and the root.
+"""
+import xml.etree.cElementTree as ET
+import resource
+import tempfile
+import os
+import pbf #local *.py file
+
+TOP_LEVEL = ("node", "way", "relation")
+
+
+def iter_elements(source, tags=TOP_LEVEL, root=False, workers=None):
+    """
+    Yields the completed children of the root element of source (a filename
+    or file object) whose tag is in tags, or all of them if tags is None.
+    Each element is cleared once the caller asks for the next one.
+    With root=True the (by then empty) root element is yielded last.
+    Files ending in ".pbf" are read with pbf.iter_elements(), decoding blobs
+    in a pool of workers processes.
+    """
+    if pbf.is_pbf(source):
+        for elem in pbf.iter_elements(source, tags, workers):
+            yield elem
+        if root:
+            yield ET.Element('osm')
+        return
+    depth = 0
+    top = None
+    parser = ET.iterparse(source, events=("start", "end"))
+    for event, elem in parser:
+        if event == "start":
+            if top is None:
+                top = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if tags is None or elem.tag in tags:
+                yield elem
+            # Safe to clear() now that the caller is done with the element
+            elem.clear()
+            top.clear()
+    del parser
+    if root and top is not None:
+        yield top
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in kilobytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def write_nodes(f, count):
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+    for i in xrange(count):
+        f.write(' <node id="%d" lat="35.1" lon="-80.8" version="1" uid="%d">\n'
+                '  <tag k="amenity" v="school"/>\n'
+                ' </node>\n' % (i, i % 100))
+    f.write('</osm>\n')
+
+
+def memory_test():
+    """
+    Streams a 400,000 node file and checks that peak memory stays flat.
+    Keeping the empty node shells alone would need well over 50MB.
+    """
+    fd, filename = tempfile.mkstemp(suffix='.osm')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write_nodes(f, 400000)
+        before = peak_rss()
+        count = 0
+        for elem in iter_elements(filename):
+            assert len(elem) == 1
+            count += 1
+        growth = peak_rss() - before
+        print count, 'nodes,', growth, 'KB peak RSS growth'
+        assert count == 400000
+        assert growth < 16 * 1024
+    finally:
+        os.remove(filename)
+
+
+def example_test():
+    counts = {}
+    for elem in iter_elements('example.osm'):
+        counts[elem.tag] = counts.get(elem.tag, 0) + 1
+    assert counts == {'node': 46721, 'relation': 44, 'way': 3781}
+
+
+if __name__ == "__main__":
+    memory_test()
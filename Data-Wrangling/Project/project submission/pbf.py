@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# pbf.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Reads OpenStreetMap PBF files (*.osm.pbf) without converting them to XML.
+
+A PBF file is a sequence of blobs, each preceded by a 4 byte length and a
+BlobHeader. "OSMData" blobs hold a zlib compressed PrimitiveBlock with a string
+table and groups of Nodes, DenseNodes, Ways and Relations, all encoded as
+protocol buffers. The few protobuf rules needed here (varints, zigzag signed
+ints, packed and length delimited fields) are decoded by hand below.
+
+Blobs are decoded in a process pool into plain tuples, and every record is then
+turned into an ElementTree element that looks just like the XML one:
+
+<node id="..." lat="..." lon="..." version="..." timestamp="..." ...>
+  <tag k="..." v="..."/>
+</node>
+
+so shape_element(), audit.audit(), users.process_map() and count_tags() work
+on PBF input unchanged. osmstream.iter_elements() uses this module for any file
+ending in ".pbf".
+"""
+import xml.etree.cElementTree as ET
+from collections import deque
+import multiprocessing
+import struct
+import time
+import zlib
+
+TOP_LEVEL = ("node", "way", "relation")
+MEMBER_TYPES = ("node", "way", "relation")
+
+
+def is_pbf(filename):
+    return isinstance(filename, basestring) and filename.endswith('.pbf')
+
+
+def read_varint(buf, pos):
+    """Returns the varint at buf[pos] and the position after it."""
+    result = 0
+    shift = 0
+    while True:
+        b = ord(buf[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(n):
+    """Decodes a protobuf sint32/sint64 value."""
+    return (n >> 1) ^ -(n & 1)
+
+
+def signed(n):
+    """Decodes a protobuf int32/int64 value (two's complement)."""
+    if n >= 1 << 63:
+        n -= 1 << 64
+    return n
+
+
+def iter_fields(buf):
+    """Yields (field number, value) for each field of the message in buf."""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = read_varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('Unsupported wire type {0}'.format(wire_type))
+        yield number, value
+
+
+def packed(buf):
+    """Returns the list of varints in a packed repeated field."""
+    values = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def delta(values):
+    """Undoes the delta coding of a packed sint field."""
+    total = 0
+    result = []
+    for value in values:
+        total += zigzag(value)
+        result.append(total)
+    return result
+
+
+def iter_blobs(filename):
+    """Yields (blob type, raw Blob message) for each blob in filename."""
+    with open(filename, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                break
+            header = f.read(struct.unpack('>I', size)[0])
+            blob_type = None
+            datasize = 0
+            for number, value in iter_fields(header):
+                if number == 1:
+                    blob_type = value
+                elif number == 3:
+                    datasize = value
+            yield blob_type, f.read(datasize)
+
+
+def blob_data(blob):
+    """Returns the uncompressed contents of a Blob message."""
+    for number, value in iter_fields(blob):
+        if number == 1:
+            return value
+        elif number == 3:
+            return zlib.decompress(value)
+        elif number in (4, 5, 6, 7):
+            raise ValueError('Unsupported blob compression (field {0})'.format(number))
+    return ''
+
+
+class Block(object):
+    """PrimitiveBlock settings needed to decode its primitives."""
+
+    def __init__(self, strings, granularity, lat_offset, lon_offset, date_granularity):
+        self.strings = strings
+        self.granularity = granularity
+        self.lat_offset = lat_offset
+        self.lon_offset = lon_offset
+        self.date_granularity = date_granularity
+
+    def lat(self, value):
+        return '%.7f' % (1e-9 * (self.lat_offset + self.granularity * value))
+
+    def lon(self, value):
+        return '%.7f' % (1e-9 * (self.lon_offset + self.granularity * value))
+
+    def timestamp(self, value):
+        seconds = value * self.date_granularity // 1000
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+    def tags(self, keys, vals):
+        s = self.strings
+        return [(s[k], s[v]) for k, v in zip(keys, vals)]
+
+    def info(self, buf, attrib):
+        """Adds the fields of an Info message to attrib."""
+        for number, value in iter_fields(buf):
+            if number == 1:
+                attrib['version'] = str(value)
+            elif number == 2:
+                attrib['timestamp'] = self.timestamp(signed(value))
+            elif number == 3:
+                attrib['changeset'] = str(signed(value))
+            elif number == 4:
+                attrib['uid'] = str(signed(value))
+            elif number == 5:
+                attrib['user'] = self.strings[value]
+            elif number == 6:
+                attrib['visible'] = 'true' if value else 'false'
+        return attrib
+
+
+def decode_dense(block, buf, records):
+    """Appends the nodes of a DenseNodes message to records."""
+    ids = lats = lons = []
+    keys_vals = []
+    info = {}
+    for number, value in iter_fields(buf):
+        if number == 1:
+            ids = delta(packed(value))
+        elif number == 5:
+            info = dict(iter_fields(value))
+        elif number == 8:
+            lats = delta(packed(value))
+        elif number == 9:
+            lons = delta(packed(value))
+        elif number == 10:
+            keys_vals = packed(value)
+    versions = packed(info.get(1, ''))
+    timestamps = delta(packed(info.get(2, '')))
+    changesets = delta(packed(info.get(3, '')))
+    uids = delta(packed(info.get(4, '')))
+    user_sids = delta(packed(info.get(5, '')))
+    s = block.strings
+    kv = 0
+    for i in xrange(len(ids)):
+        attrib = {'id': str(ids[i]),
+                  'lat': block.lat(lats[i]),
+                  'lon': block.lon(lons[i])}
+        if versions:
+            attrib['version'] = str(versions[i])
+            attrib['timestamp'] = block.timestamp(timestamps[i])
+            attrib['changeset'] = str(changesets[i])
+            attrib['uid'] = str(uids[i])
+            attrib['user'] = s[user_sids[i]]
+        tags = []
+        # keys_vals holds k, v string ids for each node, ended by a 0
+        while kv < len(keys_vals) and keys_vals[kv] != 0:
+            tags.append((s[keys_vals[kv]], s[keys_vals[kv + 1]]))
+            kv += 2
+        kv += 1
+        records.append(('node', attrib, tags, None, None))
+
+
+def decode_primitive(block, kind, buf, records):
+    """Appends one Node, Way or Relation message to records."""
+    attrib = {}
+    keys = vals = refs = roles = memids = types = []
+    lat = lon = 0
+    for number, value in iter_fields(buf):
+        if number == 1:
+            attrib['id'] = str(zigzag(value) if kind == 'node' else signed(value))
+        elif number == 2:
+            keys = packed(value)
+        elif number == 3:
+            vals = packed(value)
+        elif number == 4:
+            block.info(value, attrib)
+        elif number == 8:
+            if kind == 'node':
+                lat = zigzag(value)
+            elif kind == 'way':
+                refs = delta(packed(value))
+            else:
+                roles = packed(value)
+        elif number == 9:
+            if kind == 'node':
+                lon = zigzag(value)
+            else:
+                memids = delta(packed(value))
+        elif number == 10:
+            types = packed(value)
+    if kind == 'node':
+        attrib['lat'] = block.lat(lat)
+        attrib['lon'] = block.lon(lon)
+    members = None
+    if kind == 'relation':
+        members = [(MEMBER_TYPES[t], str(m), block.strings[r])
+                   for t, m, r in zip(types, memids, roles)]
+    records.append((kind, attrib, block.tags(keys, vals),
+                    [str(r) for r in refs] if kind == 'way' else None,
+                    members))
+
+
+def decode_block(data):
+    """
+    Decodes a PrimitiveBlock into a list of records
+    (tag, attrib, [(k, v), ...], node refs, [(type, ref, role), ...]).
+    """
+    strings = []
+    groups = []
+    settings = {17: 100, 18: 1000, 19: 0, 20: 0}
+    for number, value in iter_fields(data):
+        if number == 1:
+            strings = [s for n, s in iter_fields(value) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number in settings:
+            settings[number] = signed(value)
+    block = Block(strings, settings[17], settings[19], settings[20], settings[18])
+    records = []
+    for group in groups:
+        for number, value in iter_fields(group):
+            if number == 1:
+                decode_primitive(block, 'node', value, records)
+            elif number == 2:
+                decode_dense(block, value, records)
+            elif number == 3:
+                decode_primitive(block, 'way', value, records)
+            elif number == 4:
+                decode_primitive(block, 'relation', value, records)
+    return records
+
+
+def decode_blob(blob):
+    """Decompresses and decodes one OSMData blob. Runs in a worker process."""
+    return decode_block(blob_data(blob))
+
+
+def iter_records(filename, workers=None):
+    """
+    Yields the records of filename in file order. Blobs are decoded in a pool
+    of workers processes (cpu_count() by default), or in this process if
+    workers is 0.
+    The blobs are read here, so read errors reach the caller, and at most
+    2 * workers of them are in the pool at a time, so memory stays flat
+    however far the decoding gets ahead of the caller.
+    """
+    blobs = (blob for blob_type, blob in iter_blobs(filename)
+             if blob_type == 'OSMData')
+    if workers == 0:
+        for blob in blobs:
+            for record in decode_blob(blob):
+                yield record
+        return
+    window = 2 * (workers or multiprocessing.cpu_count())
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        for blob in blobs:
+            pending.append(pool.apply_async(decode_blob, (blob,)))
+            if len(pending) >= window:
+                for record in pending.popleft().get():
+                    yield record
+        while pending:
+            for record in pending.popleft().get():
+                yield record
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def to_element(record):
+    """Builds the ElementTree element an OSM XML file would contain."""
+    tag, attrib, tags, refs, members = record
+    elem = ET.Element(tag, attrib)
+    for ref in refs or ():
+        ET.SubElement(elem, 'nd', {'ref': ref})
+    for member_type, ref, role in members or ():
+        ET.SubElement(elem, 'member', {'type': member_type, 'ref': ref, 'role': role})
+    for k, v in tags:
+        ET.SubElement(elem, 'tag', {'k': k, 'v': v})
+    return elem
+
+
+def iter_elements(filename, tags=TOP_LEVEL, workers=None):
+    """Yields an element for each record whose tag is in tags (or all if None)."""
+    for record in iter_records(filename, workers):
+        if tags is None or record[0] in tags:
+            yield to_element(record)
+
+
+def encode_varint(n):
+    """The inverse of read_varint(), for test()."""
+    out = ''
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if not n:
+            return out + chr(b)
+        out += chr(b | 0x80)
+
+
+def encode_field(number, value):
+    """Encodes an int as a varint field, or a str as a length delimited one."""
+    if isinstance(value, str):
+        return encode_varint(number << 3 | 2) + encode_varint(len(value)) + value
+    return encode_varint(number << 3) + encode_varint(value)
+
+
+def encode_packed(values, deltas=False):
+    """Encodes a packed field, zigzag delta coded if deltas is True."""
+    if deltas:
+        previous = 0
+        coded = []
+        for value in values:
+            n = value - previous
+            coded.append((n << 1) ^ (n >> 63))
+            previous = value
+        values = coded
+    return ''.join(encode_varint(v) for v in values)
+
+
+def encode_blob(blob_type, data):
+    blob = encode_field(2, len(data)) + encode_field(3, zlib.compress(data))
+    header = encode_field(1, blob_type) + encode_field(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def encode_block(strings, groups):
+    table = encode_field(1, ''.join(encode_field(1, s) for s in strings))
+    return table + ''.join(encode_field(2, g) for g in groups) + encode_field(17, 100)
+
+
+def write_test_file(filename):
+    """
+    Writes a small PBF file by hand: a block of DenseNodes with tags, then a
+    block with a way and a relation.
+    """
+    strings = ['', 'amenity', 'school', 'addr:street', 'W 9th St', 'alice',
+               'highway', 'residential', 'type', 'multipolygon', 'outer']
+    info = (encode_field(1, encode_packed([2, 1])) +
+            encode_field(2, encode_packed([1375548222, 1375548282], True)) +
+            encode_field(3, encode_packed([17206049, 17206050], True)) +
+            encode_field(4, encode_packed([1219059, 1219059], True)) +
+            encode_field(5, encode_packed([5, 5], True)))
+    dense = (encode_field(1, encode_packed([2406124091, 2406124092], True)) +
+             encode_field(5, info) +
+             encode_field(8, encode_packed([351882069, 351882169], True)) +
+             encode_field(9, encode_packed([-808542255, -808542155], True)) +
+             encode_field(10, encode_packed([1, 2, 3, 4, 0, 0])))
+    way_info = encode_field(4, encode_field(1, 3) + encode_field(2, 1375548222) +
+                            encode_field(3, 17206049) + encode_field(4, 1219059) +
+                            encode_field(5, 5))
+    way = (encode_field(1, 209809850) + encode_field(2, encode_packed([6])) +
+           encode_field(3, encode_packed([7])) + way_info +
+           encode_field(8, encode_packed([2406124091, 2406124092], True)))
+    relation = (encode_field(1, 1791) + encode_field(2, encode_packed([8])) +
+                encode_field(3, encode_packed([9])) + way_info +
+                encode_field(8, encode_packed([10])) +
+                encode_field(9, encode_packed([209809850], True)) +
+                encode_field(10, encode_packed([1])))
+    with open(filename, 'wb') as f:
+        f.write(encode_blob('OSMHeader', encode_field(4, 'OsmSchema-V0.6')))
+        f.write(encode_blob('OSMData', encode_block(strings, [encode_field(2, dense)])))
+        f.write(encode_blob('OSMData', encode_block(
+            strings, [encode_field(3, way), encode_field(4, relation)])))
+
+
+def test():
+    import tempfile
+    import os
+    import data #local *.py file
+    fd, filename = tempfile.mkstemp(suffix='.osm.pbf')
+    os.close(fd)
+    try:
+        write_test_file(filename)
+        elements = list(iter_elements(filename, workers=0))
+        pooled = list(iter_elements(filename, workers=2))
+        assert [ET.tostring(e) for e in pooled] == [ET.tostring(e) for e in elements]
+        node, untagged, way, relation = elements
+        assert node.attrib == {'id': '2406124091', 'lat': '35.1882069',
+                               'lon': '-80.8542255', 'version': '2',
+                               'timestamp': '2013-08-03T16:43:42Z',
+                               'changeset': '17206049', 'uid': '1219059',
+                               'user': 'alice'}
+        assert untagged.get('id') == '2406124092' and not list(untagged)
+        assert [nd.get('ref') for nd in way.iter('nd')] == ['2406124091', '2406124092']
+        assert [m.attrib for m in relation.iter('member')] == [
+            {'type': 'way', 'ref': '209809850', 'role': 'outer'}]
+        assert data.shape_element(node) == {
+            'id': '2406124091', 'type': 'node', 'pos': [35.1882069, -80.8542255],
+            'created': {'version': '2', 'timestamp': '2013-08-03T16:43:42Z',
+                        'changeset': '17206049', 'uid': '1219059', 'user': 'alice'},
+            'amenity': 'school', 'address': {'street': 'West 9th Street'}}
+        assert data.shape_element(way)['node_refs'] == ['2406124091', '2406124092']
+    finally:
+        os.remove(filename)
+    # Read errors reach the caller in the pooled path too
+    try:
+        list(iter_elements(filename, workers=2))
+    except IOError:
+        pass
+    else:
+        raise AssertionError('missing file was not reported')
+
+
+def example_test():
+    counts = {}
+    for elem in iter_elements('example.osm.pbf'):
+        counts[elem.tag] = counts.get(elem.tag, 0) + 1
+    print counts
+    assert counts == {'node': 46721, 'relation': 44, 'way': 3781}
+
+
+if __name__ == "__main__":
+    test()
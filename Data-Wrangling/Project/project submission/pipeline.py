@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# pipeline.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Runs the loop of data.process_map as three stages in their own threads, so
+reading the file, shaping the elements and writing the output overlap:
+
+- read:  reads an XML map file in raw blocks of block_size bytes, which are
+         not split on element boundaries (a PBF file is decoded here
+         instead, into batches of batch_size elements)
+- shape: parses the byte blocks into elements and shapes them into batches
+         of batch_size documents
+- write: hands each document to the writer
+
+The stages are connected by queues holding at most queue_size items (byte
+blocks or element batches, then document batches), so a stage that gets
+ahead waits for the next one instead of filling memory.
+Reading and writing files release the GIL, which is what lets the disk work
+while shape_element() runs. This pays off most on slow or network storage.
+
+    pipe = Pipeline()
+    data.process_map('charlotte.osm', pipeline=pipe)
+    pprint.pprint(pipe.report())
+
+report() gives, for each stage, the number of items it handled (blocks or
+batches read, documents shaped and written), the seconds it spent waiting
+for input (the stage before it is slower), waiting to pass on output (the
+stage after it is slower), and working, plus how full its output queue was.
+The stage with the most working time is the bottleneck.
+"""
+import threading
+import Queue
+import time
+import osmstream #local *.py file
+import pbf #local *.py file
+
+BLOCK_SIZE = 1 << 20
+BATCH_SIZE = 500
+QUEUE_SIZE = 8
+STAGES = ('read', 'shape', 'write')
+
+
+class StageStats(object):
+
+    def __init__(self):
+        self.items = 0
+        self.started = None
+        self.finished = None
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+        self.depths = []
+
+    def report(self):
+        seconds = (self.finished or time.time()) - (self.started or time.time())
+        result = {'items': self.items,
+                  'seconds': seconds,
+                  'input_wait': self.input_wait,
+                  'output_wait': self.output_wait,
+                  'working': seconds - self.input_wait - self.output_wait}
+        if self.depths:
+            result['queue_depth'] = {'max': max(self.depths),
+                                     'mean': float(sum(self.depths)) / len(self.depths)}
+        return result
+
+
+class QueueReader(object):
+    """A file-like object reading the blocks put on a queue, up to None."""
+
+    def __init__(self, pipe, queue, stats):
+        self.pipe = pipe
+        self.queue = queue
+        self.stats = stats
+        self.buffer = ''
+        self.done = False
+
+    def read(self, size=BLOCK_SIZE):
+        if not self.buffer and not self.done:
+            block = self.pipe.get(self.queue, self.stats)
+            if block is None:
+                self.done = self.pipe.input_done = True
+            else:
+                self.buffer = block
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+
+class Pipeline(object):
+
+    def __init__(self, queue_size=QUEUE_SIZE, block_size=BLOCK_SIZE,
+                 batch_size=BATCH_SIZE):
+        self.queue_size = queue_size
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.stats = dict((name, StageStats()) for name in STAGES)
+        self.error = None
+        self.stopped = False
+        self.input_done = False
+
+    def put(self, queue, item, stats):
+        start = time.time()
+        queue.put(item)
+        stats.output_wait += time.time() - start
+        stats.depths.append(queue.qsize())
+
+    def get(self, queue, stats):
+        start = time.time()
+        item = queue.get()
+        stats.input_wait += time.time() - start
+        return item
+
+    def drain(self, queue):
+        """Empties queue up to None, so the stage before never blocks."""
+        while queue.get() is not None:
+            pass
+
+    def read(self, file_in, out, workers):
+        stats = self.stats['read']
+        stats.started = time.time()
+        try:
+            if pbf.is_pbf(file_in):
+                batch = []
+                for elem in pbf.iter_elements(file_in, workers=workers):
+                    batch.append(elem)
+                    if len(batch) >= self.batch_size:
+                        stats.items += 1
+                        self.put(out, batch, stats)
+                        batch = []
+                        if self.stopped:
+                            break
+                if batch:
+                    stats.items += 1
+                    self.put(out, batch, stats)
+            else:
+                with open(file_in, 'rb') as f:
+                    while not self.stopped:
+                        block = f.read(self.block_size)
+                        if not block:
+                            break
+                        stats.items += 1
+                        self.put(out, block, stats)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            out.put(None)
+            stats.finished = time.time()
+
+    def iter_input(self, file_in, queue, stats):
+        """Yields the elements from the read stage."""
+        if pbf.is_pbf(file_in):
+            while True:
+                batch = self.get(queue, stats)
+                if batch is None:
+                    self.input_done = True
+                    return
+                for elem in batch:
+                    yield elem
+        else:
+            for elem in osmstream.iter_elements(QueueReader(self, queue, stats)):
+                yield elem
+
+    def shape(self, file_in, shape, queue, out):
+        stats = self.stats['shape']
+        stats.started = time.time()
+        try:
+            batch = []
+            for elem in self.iter_input(file_in, queue, stats):
+                el = shape(elem)
+                if el:
+                    batch.append(el)
+                    if len(batch) >= self.batch_size:
+                        stats.items += len(batch)
+                        self.put(out, batch, stats)
+                        batch = []
+                        if self.stopped:
+                            break
+            if batch:
+                stats.items += len(batch)
+                self.put(out, batch, stats)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            out.put(None)
+            if not self.input_done:
+                self.drain(queue)
+            stats.finished = time.time()
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped = True
+
+    def run(self, file_in, shape, write, workers=None):
+        """
+        Shapes the elements of file_in with shape() in a pipeline and passes
+        every document it returns to write(). Raises the first error of any
+        stage once all of them have stopped.
+        """
+        raw = Queue.Queue(self.queue_size)
+        shaped = Queue.Queue(self.queue_size)
+        threads = [threading.Thread(target=self.read, args=(file_in, raw, workers)),
+                   threading.Thread(target=self.shape, args=(file_in, shape, raw, shaped))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        stats = self.stats['write']
+        stats.started = time.time()
+        try:
+            while True:
+                batch = self.get(shaped, stats)
+                if batch is None:
+                    break
+                for el in batch:
+                    write(el)
+                stats.items += len(batch)
+        except Exception as e:
+            self.fail(e)
+            self.drain(shaped)
+        stats.finished = time.time()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        result = dict((name, stats.report()) for name, stats in self.stats.items())
+        result['bottleneck'] = max(STAGES, key=lambda name: result[name]['working'])
+        return result
+
+
+def example_test():
+    import pprint
+    import data #local *.py file
+    data.process_map('example.osm')
+    with open('example.osm.json') as f:
+        expected = f.read()
+    pipe = Pipeline(batch_size=100)
+    data.process_map('example.osm', pipeline=pipe)
+    with open('example.osm.json') as f:
+        assert f.read() == expected
+    pprint.pprint(pipe.report())
+    assert pipe.report()['write']['items'] == 46721 + 3781
+
+
+def test():
+    import tempfile
+    import shutil
+    import os
+    import data #local *.py file
+    import generate #local *.py file
+    import instrument #local *.py file
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'small.osm.pbf')
+        pbf.write_test_file(filename)
+        pipe = Pipeline(batch_size=2)
+        assert data.process_map(filename, pipeline=pipe) == 3
+        report = pipe.report()
+        # Two batches of elements, the last one not full
+        assert report['read']['items'] == 2
+        assert report['shape']['items'] == report['write']['items'] == 3
+        filename = os.path.join(tmp, 'map.osm')
+        generate.generate(filename, 300000, seed=2)
+        expected = data.process_map(filename)
+        pipe = Pipeline(block_size=4096)
+        assert data.process_map(filename, pipeline=pipe) == expected
+        assert pipe.report()['read']['items'] == -(-os.path.getsize(filename) // 4096)
+        for kwargs in ({'workers': 2}, {'shards': True},
+                       {'stats': instrument.Stats()}):
+            try:
+                data.process_map(filename, pipeline=Pipeline(), **kwargs)
+            except ValueError:
+                pass
+            else:
+                assert False, kwargs
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    example_test()
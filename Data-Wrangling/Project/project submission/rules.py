@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# rules.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Loads the cleaning rules data.py applies from a JSON file, so a new region
+can be cleaned by editing rules.json instead of the code:
+
+- drop_keys, drop_prefixes: tag keys that are left out, exactly or by prefix
+- rename_keys: keys stored under another name ("type" would overwrite the
+  element type, so it becomes "service_type")
+- rename_node_keys: the same for nodes only ("ref" is a highway exit number
+  on a node, but stays "ref" on a way)
+- value_maps: {key: {value: replacement}} for exact value fixes
+- postcode_digits: longer "addr:postcode" values are cut to this many digits
+- street_abbreviations, street_keep_after: the mapping and the words after
+  which nothing is replaced ("Suite E") used to fix street names, see
+  audit.StreetNormalizer
+
+compile() turns the rules into the sets and dictionaries the shaping code
+looks keys up in, once, and data.use_rules() switches data.py over to them.
+The TIGER street name assembly stays in data.process_tiger(), since it
+depends on the structure of the data rather than on the region.
+
+    python rules.py charlotte.osm
+
+times the shaping with these rules, and with thousands more, which should
+take no longer. 'python benchmark.py --shape charlotte.osm' compares them
+with the keys written into the code, the way data.py cleaned before
+rules.json.
+"""
+import hashlib
+import json
+import sys
+import os
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+
+
+def load(filename=RULES_FILE):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def fix_postcode(v, digits=5):
+    """
+    Reduces postcodes to strings of digits. Some zips take the form
+    'NC12345' or '12345-6789' hindering MongoDB aggregations.
+    """
+    postcode = ''
+    for char in v:
+        if char.isdigit():
+            postcode += char
+        if len(postcode) == digits:
+            break
+    return postcode
+
+
+class CompiledRules(object):
+
+    def __init__(self, rules):
+        self.version = hashlib.md5(json.dumps(rules, sort_keys=True)).hexdigest()
+        self.drop_keys = frozenset(rules.get('drop_keys', ()))
+        # str.startswith() takes a tuple and checks all prefixes in one call
+        self.drop_prefixes = tuple(rules.get('drop_prefixes', ()))
+        renames = rules.get('rename_keys', {})
+        node_renames = dict(renames)
+        node_renames.update(rules.get('rename_node_keys', {}))
+        self.renames = {'node': node_renames, 'way': dict(renames)}
+        self.renamed_keys = frozenset(node_renames)
+        self.value_maps = dict((k, dict(values))
+                               for k, values in rules.get('value_maps', {}).items())
+        self.postcode_digits = rules.get('postcode_digits', 5)
+        # audit.py reads its street name mapping from rules.json
+        import audit #local *.py file
+        self.normalizer = audit.StreetNormalizer(
+            rules.get('street_abbreviations', audit.mapping))
+        if 'street_keep_after' in rules:
+            self.normalizer.keep_after = frozenset(rules['street_keep_after'])
+
+    def dropped(self, k):
+        """Returns True if key k should be ignored."""
+        return k in self.drop_keys or k.startswith(self.drop_prefixes)
+
+    def fix_postcode(self, v):
+        return fix_postcode(v, self.postcode_digits)
+
+
+def compile(rules):
+    return CompiledRules(rules)
+
+
+def shape_time(filename, extra_rules=0, repeat=5, shape=None):
+    """
+    Returns the best time in microseconds data.shape_element() took per
+    element of filename (read into memory first), cleaning with the rules
+    in rules.json plus extra_rules made up key drops and value maps. The
+    lookups are compiled, so the time should not grow with extra_rules.
+    A different shape function can be timed instead, see
+    benchmark.ReferenceShaper.
+    """
+    import xml.etree.cElementTree as ET
+    import copy
+    import time
+    import data #local *.py file
+    custom = load()
+    for i in range(extra_rules):
+        custom['drop_keys'].append('dropped_{0}'.format(i))
+        custom.setdefault('value_maps', {})['mapped_{0}'.format(i)] = {'a': 'b'}
+    elements = [elem for elem in ET.parse(filename).getroot()
+                if elem.tag in ('node', 'way')]
+    data.use_rules(compile(custom))
+    shape = shape or data.shape_element
+    best = None
+    try:
+        for i in range(repeat):
+            # shape_element() clears the elements it shapes
+            copies = [copy.deepcopy(elem) for elem in elements]
+            start = time.time()
+            for elem in copies:
+                shape(elem)
+            seconds = time.time() - start
+            if best is None or seconds < best:
+                best = seconds
+    finally:
+        data.use_rules(compile(load()))
+    return best / max(len(elements), 1) * 1e6
+
+
+def test():
+    import xml.etree.cElementTree as ET
+    import data #local *.py file
+    rules = compile(load())
+    assert rules.normalizer('S Tryon St Ste E') == 'South Tryon Street Suite E'
+    assert rules.dropped('gnis:feature_id') and not rules.dropped('name')
+    assert rules.renames['node']['ref'] == 'exit_number'
+    assert 'ref' not in rules.renames['way']
+    assert rules.fix_postcode('NC28209-1234') == '28209'
+    custom = load()
+    custom['drop_keys'].append('name_1')
+    custom['value_maps'] = {'amenity': {'place_of_worship': 'church'}}
+    custom['rename_keys']['ref'] = 'reference'
+    data.use_rules(compile(custom))
+    try:
+        node = data.shape_element(ET.fromstring(
+            '<node id="1" lat="35" lon="-80"><tag k="name_1" v="x"/>'
+            '<tag k="amenity" v="place_of_worship"/><tag k="ref" v="12"/></node>'))
+        assert node == {'id': '1', 'type': 'node', 'created': {}, 'pos': [35.0, -80.0],
+                        'amenity': 'church', 'exit_number': '12'}
+        way = data.shape_element(ET.fromstring(
+            '<way id="2"><tag k="ref" v="12"/></way>'))
+        assert way['reference'] == '12'
+    finally:
+        data.use_rules(compile(load()))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        for extra_rules in (0, 5000):
+            print '{0:5} extra rules: {1:.2f} us per element'.format(
+                extra_rules, shape_time(sys.argv[1], extra_rules))
+    else:
+        test()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# sketches.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Approximate statistics in fixed memory, for extracts too big for the exact
+set() of users.process_map or the dictionary of mapparser.count_tags.
+
+- HyperLogLog counts distinct values (users, street names, keys, values).
+  Its standard error is 1.04 / sqrt(2 ** precision), 0.8% for precision 14,
+  in 16KB.
+- CountMinSketch estimates how often each value was seen. An estimate is
+  never too low, and is at most epsilon * total too high with probability
+  1 - delta.
+- TopK keeps the k most frequent values (heavy hitters) according to a
+  CountMinSketch.
+
+All of them can be merged, so each worker of a process pool can fill its own
+and the results are combined afterwards. approx_stats() does that over the
+byte ranges from chunks.split() and returns the estimates together with their
+error bounds.
+"""
+import multiprocessing
+import hashlib
+import heapq
+import struct
+import math
+import numpy as np
+import chunks #local *.py file
+
+MASK = (1 << 64) - 1
+
+
+def hash64(value):
+    """Returns two independent 64 bit hashes of value, the same in every process."""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return struct.unpack('<QQ', hashlib.md5(value).digest())
+
+
+class HyperLogLog(object):
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, value):
+        h = hash64(value)[0]
+        i = h >> (64 - self.precision)
+        rest = (h << self.precision) & MASK
+        # Position of the first 1 bit in the remaining bits
+        rank = 64 - self.precision + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = float(self.m)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.sum(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def error(self):
+        """Returns the relative standard error of count()."""
+        return 1.04 / math.sqrt(self.m)
+
+
+class CountMinSketch(object):
+
+    def __init__(self, epsilon=0.0005, delta=0.001):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def columns(self, value):
+        h1, h2 = hash64(value)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, value, n=1):
+        """Counts value n more times and returns its new estimate."""
+        self.total += n
+        table = self.table
+        estimate = None
+        for row, col in enumerate(self.columns(value)):
+            table[row, col] += n
+            if estimate is None or table[row, col] < estimate:
+                estimate = table[row, col]
+        return int(estimate)
+
+    def estimate(self, value):
+        table = self.table
+        return int(min(table[row, col] for row, col in enumerate(self.columns(value))))
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def error(self):
+        """Returns the most an estimate can be too high, with probability 1 - delta."""
+        return self.epsilon * self.total
+
+
+class TopK(object):
+    """The k values with the highest CountMinSketch estimates."""
+
+    def __init__(self, k=20, epsilon=0.0005, delta=0.001):
+        self.k = k
+        self.sketch = CountMinSketch(epsilon, delta)
+        self.counts = {}
+        # Min heap of (count, value), entries may be out of date
+        self.heap = []
+
+    def add(self, value, n=1):
+        estimate = self.sketch.add(value, n)
+        if value in self.counts:
+            self.counts[value] = estimate
+            return
+        if len(self.counts) < self.k:
+            self.counts[value] = estimate
+            heapq.heappush(self.heap, (estimate, value))
+            return
+        while True:
+            count, smallest = self.heap[0]
+            if self.counts[smallest] != count:
+                # Stale entry: push the current count and look again
+                heapq.heapreplace(self.heap, (self.counts[smallest], smallest))
+                continue
+            if estimate > count:
+                heapq.heapreplace(self.heap, (estimate, value))
+                del self.counts[smallest]
+                self.counts[value] = estimate
+            return
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        candidates = set(self.counts) | set(other.counts)
+        ranked = sorted(((self.sketch.estimate(v), v) for v in candidates), reverse=True)
+        self.counts = dict((v, c) for c, v in ranked[:self.k])
+        self.heap = [(c, v) for v, c in self.counts.items()]
+        heapq.heapify(self.heap)
+        return self
+
+    def top(self):
+        """Returns [(value, estimated count), ...], most frequent first."""
+        return sorted(self.counts.items(), key=lambda item: -item[1])
+
+
+class StreamStats(object):
+    """
+    Fills the sketches from the top level elements of a map file:
+    distinct users, street names, tag keys and tag values, the edits per
+    user and the tags per key.
+    """
+
+    def __init__(self, k=20):
+        self.distinct = dict((name, HyperLogLog())
+                             for name in ('users', 'streets', 'keys', 'values'))
+        self.edits = TopK(k)
+        self.keys = TopK(k)
+        self.elements = 0
+
+    def process(self, elem):
+        self.elements += 1
+        uid = elem.attrib.get('uid')
+        if uid is not None:
+            self.distinct['users'].add(uid)
+            self.edits.add(uid)
+        for tag in elem.iter('tag'):
+            k = tag.attrib['k']
+            v = tag.attrib['v']
+            self.distinct['keys'].add(k)
+            self.distinct['values'].add(v)
+            self.keys.add(k)
+            if k == 'addr:street':
+                self.distinct['streets'].add(v)
+
+    def merge(self, other):
+        for name, hll in self.distinct.items():
+            hll.merge(other.distinct[name])
+        self.edits.merge(other.edits)
+        self.keys.merge(other.keys)
+        self.elements += other.elements
+        return self
+
+    def result(self):
+        return {
+            'elements': self.elements,
+            'distinct': dict((name, {'estimate': hll.count(),
+                                     'relative_error': hll.error()})
+                             for name, hll in self.distinct.items()),
+            'top_users_by_edits': {'top': self.edits.top(),
+                                   'max_overcount': self.edits.sketch.error(),
+                                   'confidence': 1 - self.edits.sketch.delta},
+            'top_keys': {'top': self.keys.top(),
+                         'max_overcount': self.keys.sketch.error(),
+                         'confidence': 1 - self.keys.sketch.delta}}
+
+
+def stats_range(args):
+    """Fills a StreamStats from one byte range. Runs in a worker process."""
+    filename, start, end, k = args
+    stats = StreamStats(k)
+    for elem in chunks.iter_range(filename, start, end):
+        stats.process(elem)
+    return stats
+
+
+def approx_stats(filename, workers=None, k=20, chunk_size=chunks.CHUNK_SIZE):
+    """
+    Returns approximate distinct counts and heavy hitters for filename,
+    computed over its byte ranges in a process pool and merged.
+    """
+    jobs = [(filename, start, end, k)
+            for start, end in chunks.split(filename, chunk_size)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        stats = StreamStats(k)
+        for part in pool.imap_unordered(stats_range, jobs):
+            stats.merge(part)
+    finally:
+        pool.close()
+        pool.join()
+    return stats.result()
+
+
+def example_test():
+    import pprint
+    import users #local *.py file
+    result = approx_stats('example.osm')
+    pprint.pprint(result)
+    exact = len(users.process_map('example.osm'))
+    estimate = result['distinct']['users']['estimate']
+    assert abs(estimate - exact) <= 3 * result['distinct']['users']['relative_error'] * exact + 1
+
+
+if __name__ == "__main__":
+    example_test()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# spatial.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+A grid index over the "pos" values of the shaped nodes, to answer questions
+like "amenities within this box" or "nearest school" from the JSON output
+without loading it into MongoDB.
+
+The world is cut into square cells of cell_size degrees. Every position gets
+the number of its cell (row * columns + column), and the positions are stored
+sorted by that number, so the points of a run of cells in one row are next to
+each other and are found with np.searchsorted. The index keeps the byte
+offset of each document in the JSON output, which read_document() uses to
+load the document itself.
+
+process_map(spatial=True) wraps its writer in an IndexedWriter, which saves
+the index as '<file_out>.grid.npz' next to the JSON output.
+
+    index = GridIndex.load('charlotte.osm.json.grid.npz')
+    offsets = index.bbox(35.20, -80.86, 35.24, -80.82)
+    offsets, meters = index.nearest(35.2271, -80.8431, k=5)
+"""
+from array import array
+import numpy as np
+import json
+import math
+
+CELL_SIZE = 0.01
+EARTH_RADIUS = 6371008.8
+
+
+class GridIndex(object):
+
+    def __init__(self, lats, lons, offsets, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.columns = int(math.ceil(360.0 / cell_size))
+        keys = self.cells(lats, lons)
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+        self.lons = np.asarray(lons, dtype=np.float64)[order]
+        self.offsets = np.asarray(offsets, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row(self, lat):
+        return np.floor((np.asarray(lat) + 90.0) / self.cell_size).astype(np.int64)
+
+    def column(self, lon):
+        return np.floor((np.asarray(lon) + 180.0) / self.cell_size).astype(np.int64)
+
+    def cells(self, lats, lons):
+        return self.row(lats) * self.columns + self.column(lons)
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """Returns the positions (into the sorted arrays) in the covered cells."""
+        first, last = int(self.column(min_lon)), int(self.column(max_lon))
+        found = []
+        for row in range(int(self.row(min_lat)), int(self.row(max_lat)) + 1):
+            start = np.searchsorted(self.keys, row * self.columns + first)
+            end = np.searchsorted(self.keys, row * self.columns + last, 'right')
+            if end > start:
+                found.append(np.arange(start, end))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Returns the document offsets of all positions in the box."""
+        i = self.candidates(min_lat, min_lon, max_lat, max_lon)
+        lats, lons = self.lats[i], self.lons[i]
+        inside = ((lats >= min_lat) & (lats <= max_lat) &
+                  (lons >= min_lon) & (lons <= max_lon))
+        return self.offsets[i[inside]]
+
+    def distances(self, i, lat, lon):
+        """Returns the distance in meters from (lat, lon) to positions i."""
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = np.radians(self.lats[i]), np.radians(self.lons[i])
+        a = (np.sin((lat2 - lat1) / 2) ** 2 +
+             math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Returns the document offsets of the k positions nearest to
+        (lat, lon), and their distances in meters, closest first.
+        """
+        k = min(k, len(self))
+        radius = self.cell_size
+        # A degree of longitude shrinks by cos(lat), so the box holds every
+        # point within radius degrees of longitude measured at this latitude
+        shrink = math.cos(math.radians(min(abs(lat) + radius, 90.0)))
+        while True:
+            i = self.candidates(lat - radius, lon - radius, lat + radius, lon + radius)
+            if len(i) >= k:
+                meters = self.distances(i, lat, lon)
+                order = np.argsort(meters)[:k]
+                covered = math.radians(radius) * EARTH_RADIUS * shrink
+                if k == 0 or meters[order[-1]] <= covered:
+                    return self.offsets[i[order]], meters[order]
+            if radius > 360:
+                i = np.arange(len(self))
+                meters = self.distances(i, lat, lon)
+                order = np.argsort(meters)[:k]
+                return self.offsets[i[order]], meters[order]
+            radius *= 2
+            shrink = math.cos(math.radians(min(abs(lat) + radius, 90.0)))
+
+    def save(self, filename):
+        np.savez(filename, cell_size=self.cell_size, lats=self.lats,
+                 lons=self.lons, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, filename):
+        arrays = np.load(filename)
+        return cls(arrays['lats'], arrays['lons'], arrays['offsets'],
+                   float(arrays['cell_size']))
+
+
+class IndexedWriter(object):
+    """
+    Passes elements on to writer and indexes the "pos" of each one at the
+    offset writer.write() returns. close() saves the index to filename.
+    """
+
+    def __init__(self, writer, filename, cell_size=CELL_SIZE):
+        self.writer = writer
+        self.filename = filename
+        self.cell_size = cell_size
+        self.file_out = getattr(writer, 'file_out', None)
+        self.lats = array('d')
+        self.lons = array('d')
+        self.offsets = array('l')
+
+    def write(self, el):
+        offset = self.writer.write(el)
+        if 'pos' in el:
+            self.lats.append(el['pos'][0])
+            self.lons.append(el['pos'][1])
+            self.offsets.append(offset)
+        return offset
+
+    def close(self):
+        self.writer.close()
+        size = 'i{0}'.format(self.offsets.itemsize)
+        GridIndex(np.frombuffer(self.lats, dtype=np.float64),
+                  np.frombuffer(self.lons, dtype=np.float64),
+                  np.frombuffer(self.offsets, dtype=size),
+                  self.cell_size).save(self.filename)
+
+
+def read_document(file_out, offset):
+    """Returns the document at offset of an uncompressed, one line per document output."""
+    with open(file_out, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+def example_test():
+    import data #local *.py file
+    data.process_map('example.osm', spatial=True)
+    index = GridIndex.load('example.osm.json.grid.npz')
+    assert len(index) == 46721
+    offsets, meters = index.nearest(35.1882069, -80.8542255, k=3)
+    doc = read_document('example.osm.json', offsets[0])
+    assert doc['id'] == '357796598' and meters[0] < 1
+    assert offsets[0] in index.bbox(35.18, -80.86, 35.19, -80.85)
+
+
+if __name__ == "__main__":
+    example_test()
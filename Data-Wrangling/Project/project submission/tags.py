@@ -20,6 +20,7 @@ like this:
 import xml.etree.cElementTree as ET
 import pprint
 import re
+import osmstream #local *.py file
 
 
 lower = re.compile(r'^([a-z]|_)*$')
@@ -49,13 +50,9 @@ def old_process_map(filename):
 
 def process_map(filename):
     keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
-    parser = ET.iterparse(filename)
-    for __, elem in parser:
-        keys = key_type(elem, keys)
-        # It's safe to call clear() here because no
-        # descendants will be accessed
-        elem.clear()
-    del parser
+    for elem in osmstream.iter_elements(filename):
+        for tag in elem.iter("tag"):
+            keys = key_type(tag, keys)
     return keys
 
 
@@ -12,11 +12,15 @@
 Finds out how many unique users have contributed to the map in this
 particular area.
 
-Returns a set of unique user IDs ("uid").
+Returns a set of unique user IDs ("uid"). With fast=True the IDs are read
+from the raw bytes of the file instead (see bytescan.py).
 """
 import xml.etree.cElementTree as ET
 import pprint
 import re
+import bytescan #local *.py file
+import osmstream #local *.py file
+import pbf #local *.py file
 
 
 def get_user(element):
@@ -33,17 +37,15 @@ def old_process_map(filename):
     return users
 
 
-def process_map(filename):
+def process_map(filename, fast=False, workers=None):
+    if fast and not pbf.is_pbf(filename):
+        return bytescan.users(filename)
     users = set()
-    parser = ET.iterparse(filename)
-    for __, elem in parser:
+    # Only top level elements carry a "uid" attribute
+    for elem in osmstream.iter_elements(filename, tags=None, workers=workers):
         uid = get_user(elem)
         if uid != None:
             users.add(uid)
-        # It's safe to call clear() here because no
-        # descendants will be accessed
-        elem.clear()
-    del parser
     return users
 
 
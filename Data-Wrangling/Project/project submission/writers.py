@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# writers.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Matthew T. Banbury
+# matthewbanbury@gmail.com
+
+"""
+Output stage for data.process_map. A writer has two methods:
+
+- write(el) adds one shaped element to the output.
+- close() flushes and closes the output.
+
+JSONWriter serializes elements as one JSON document per line (the format
+mongoimport reads), collecting the lines in a buffer that is only written out
+once it holds flush_size bytes. Output ending in ".gz" is gzip compressed and
+output ending in ".zst" is zstd compressed (needs the zstandard module).
+With fast=True elements are serialized with ujson or simplejson when one of
+them is installed.
+
+JSONWriter can also sync() its output to disk and reopen an uncompressed file
+at a given offset, which data.process_map uses to checkpoint and resume runs.
+
+Tee passes every element on to several writers, to write more than one kind
+of output in a single run.
+"""
+import gzip
+import json
+import os
+
+try:
+    import ujson as fast_json
+except ImportError:
+    try:
+        import simplejson as fast_json
+    except ImportError:
+        fast_json = json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FLUSH_SIZE = 4 << 20
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def output_name(file_out, compress=None):
+    """Returns file_out with the extension for compress added."""
+    return file_out + EXTENSIONS[compress]
+
+
+def open_output(file_out, level=6):
+    """Opens file_out for writing, compressing by extension."""
+    if file_out.endswith('.gz'):
+        return gzip.open(file_out, 'wb', level)
+    if file_out.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('zstd output needs the zstandard module')
+        cctx = zstandard.ZstdCompressor(level=level)
+        return cctx.stream_writer(open(file_out, 'wb'))
+    return open(file_out, 'wb')
+
+
+def encoder(pretty=False, fast=False):
+    """Returns a function serializing an element to one line of output."""
+    if pretty:
+        return lambda el: json.dumps(el, indent=2) + "\n"
+    dumps = fast_json.dumps if fast else json.dumps
+    return lambda el: dumps(el) + "\n"
+
+
+class JSONWriter(object):
+    """
+    Writes elements to file_out as JSON lines. write() returns the offset
+    of the line in the uncompressed output. With resume_at, an existing
+    uncompressed file_out is cut back to that many bytes and appended to.
+    """
+
+    def __init__(self, file_out, pretty=False, fast=False,
+                 flush_size=FLUSH_SIZE, level=6, resume_at=None):
+        self.file_out = file_out
+        if resume_at is None:
+            self.fo = open_output(file_out, level)
+            self.offset = 0
+        else:
+            if file_out.endswith(('.gz', '.zst')):
+                raise ValueError('Cannot resume compressed output')
+            self.fo = open(file_out, 'r+b')
+            self.fo.truncate(resume_at)
+            self.fo.seek(resume_at)
+            self.offset = resume_at
+        self.encode = encoder(pretty, fast)
+        self.flush_size = flush_size
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+
+    def write(self, el):
+        return self.write_line(self.encode(el))
+
+    def write_line(self, line):
+        """Adds an already serialized line to the output."""
+        offset = self.offset
+        self.buffer.append(line)
+        self.buffered += len(line)
+        self.offset += len(line)
+        self.count += 1
+        if self.buffered >= self.flush_size:
+            self.flush()
+        return offset
+
+    def flush(self):
+        if self.buffer:
+            self.fo.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def sync(self):
+        """Writes everything to disk and returns the output offset."""
+        self.flush()
+        self.fo.flush()
+        os.fsync(self.fo.fileno())
+        return self.offset
+
+    def close(self):
+        self.flush()
+        self.fo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Tee(object):
+    """
+    Writes every element to each of the given writers. write() returns
+    what the first writer returns.
+    """
+
+    def __init__(self, *writers):
+        self.writers = writers
+        self.file_out = getattr(writers[0], 'file_out', None)
+
+    def write(self, el):
+        results = [writer.write(el) for writer in self.writers]
+        return results[0]
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test():
+    import tempfile
+    import shutil
+    import os
+    tmp = tempfile.mkdtemp()
+    try:
+        docs = [{'id': str(i), 'type': 'node', 'pos': [35.0, -80.0]}
+                for i in range(1000)]
+        for compress in (None, 'gzip'):
+            file_out = output_name(os.path.join(tmp, 'test.json'), compress)
+            with JSONWriter(file_out, flush_size=1024) as writer:
+                offsets = [writer.write(doc) for doc in docs]
+            if compress:
+                lines = gzip.open(file_out).read().splitlines(True)
+            else:
+                lines = open(file_out).read().splitlines(True)
+            assert [json.loads(line) for line in lines] == docs
+            assert offsets[1] == len(lines[0])
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test()